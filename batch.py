@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+"""Runs surparser on many ItemsDeliveredRawReport.csv files in parallel.
+
+Every export gets its own database and its own directory in the output
+directory containing toetsanalyse.md and the plots; a --db file is created
+in that directory. All options that are not listed below are passed on to
+surparser.
+
+Example:
+./batch.py --input exports/ --jobs 4 --all --plot --cesuur 55
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import surparser
+
+
+def find_exports(patterns):
+    """Expands directories (recursively) and glob patterns into a sorted list of CSV files."""
+
+    filenames = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            filenames.update(glob.glob(os.path.join(pattern, "**", "*.csv"), recursive=True))
+        else:
+            filenames.update(glob.glob(pattern, recursive=True))
+    return sorted(filenames)
+
+
+def exam_names(filenames):
+    """Names every export by its path relative to the common directory of all exports.
+
+    The default file name ItemsDeliveredRawReport is left out when the export is in a subdirectory.
+    """
+
+    if not filenames:
+        return []
+    common = os.path.commonpath([os.path.dirname(os.path.abspath(filename)) for filename in filenames])
+    names = []
+    for filename in filenames:
+        parts = os.path.splitext(os.path.relpath(os.path.abspath(filename), common))[0].split(os.sep)
+        if len(parts) > 1 and parts[-1] == "ItemsDeliveredRawReport":
+            parts.pop()
+        names.append("_".join(parts))
+    return names
+
+
+def exam_arguments(filename, directory, surparser_arguments):
+    """Builds the surparser arguments of a single export.
+
+    Exported tables go to a subdirectory per export and a --db file to the directory of the
+    export, so the workers never share a database.
+    """
+
+    surparser_arguments = list(surparser_arguments)
+    for index, argument in enumerate(surparser_arguments[:-1]):
+        if argument == "--export":
+            surparser_arguments[index + 1] = os.path.join(surparser_arguments[index + 1], os.path.basename(directory))
+        elif argument == "--db" and surparser_arguments[index + 1] != ":memory:":
+            surparser_arguments[index + 1] = os.path.join(directory, os.path.basename(surparser_arguments[index + 1]))
+    return ["--plot-jobs", "1"] + surparser_arguments + [
+        "--input", filename,
+        "--output", os.path.join(directory, "toetsanalyse.md"),
+        "--plot-dir", directory
+    ]
+
+
+def run_exam(name, directory, argv):
+    """Runs surparser for a single export and returns its name, wall time and error (or None)."""
+
+    os.environ["MPLBACKEND"] = "Agg"
+    start = time.perf_counter()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        surparser.run(surparser.get_argument_parser().parse_args(argv))
+        error = None
+    except (Exception, SystemExit) as exception:
+        error = f"{type(exception).__name__}: {exception}"
+    return name, time.perf_counter() - start, error
+
+
+def run_batch(filenames, output_dir, surparser_arguments, jobs=None):
+    """Processes all exports in a process pool and returns a list of (name, seconds, error) tuples."""
+
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [
+            executor.submit(run_exam, name, os.path.join(output_dir, name),
+                            exam_arguments(filename, os.path.join(output_dir, name), surparser_arguments))
+            for name, filename in zip(exam_names(filenames), filenames)
+        ]
+        return [future.result() for future in futures]
+
+
+def output_summary(results, wall_time, output):
+    print("Toets | Status | Tijd (s)", file=output)
+    print("----- | ------ | -------:", file=output)
+    for name, seconds, error in results:
+        print("{} | {} | {:.2f}".format(name, error or "OK", seconds), file=output)
+    print(file=output)
+    print("{} toetsen in {:.2f} s".format(len(results), wall_time), file=output)
+
+
+def get_argument_parser():
+    argumentParser = argparse.ArgumentParser(description="""
+        Runs surparser on many ItemsDeliveredRawReport.csv files in parallel.
+        All other options are passed on to surparser.
+    """)
+    argumentParser.add_argument("--input",
+                                action="append",
+                                default=[],
+                                help="Directory (searched recursively) or glob pattern of CSV files; may be repeated",
+                                metavar="directory_or_pattern",
+                                required=True
+                                )
+    argumentParser.add_argument("--jobs",
+                                help="Number of worker processes (defaults to the number of CPUs)",
+                                metavar="N",
+                                type=int
+                                )
+    argumentParser.add_argument("--output-dir",
+                                default=".",
+                                dest="output_dir",
+                                help="Directory in which a directory per export is created (defaults to .)",
+                                metavar="directory"
+                                )
+    return argumentParser
+
+
+if __name__ == "__main__":
+    arguments, surparser_arguments = get_argument_parser().parse_known_args()
+    surparser.get_argument_parser().parse_args(surparser_arguments)
+    filenames = find_exports(arguments.input)
+    start = time.perf_counter()
+    results = run_batch(filenames, arguments.output_dir, surparser_arguments, arguments.jobs)
+    output_summary(results, time.perf_counter() - start, sys.stdout)
+    sys.exit(1 if any(error for _, _, error in results) else 0)
@@ -0,0 +1,316 @@
+#!/usr/bin/python3
+
+"""Benchmarks for surparser on synthetic ItemsDeliveredRawReport.csv files.
+
+Besides the load speed of read_csv and bulk_load, every phase of run() is
+timed: loading, the report sections and optionally the plots. Results can be
+written to a JSON file and compared with the results of an earlier commit.
+
+Example:
+./benchmark.py --students 400 --questions 120
+./benchmark.py --grid --json after.json --compare before.json
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import surparser
+
+
+STUDENT_COLUMNS = ["Referentie", "Voornaam", "Achternaam", "Geslacht", "Sleutelcode", "Daadwerkelijke markering",
+                   "Totaalscore", "Cijfer", "Toetsformulier", "Toets", "Centrum", "Onderwerp"]
+QUESTION_COLUMNS = ["Naam", "Totaalscore", "Sleutel", "Itemtype", "Scoretype", "LO", "Unit", "Trefwoorden",
+                    "Daadwerkelijke markering", "Reactie", "Weergavetijd", "Gepresenteerde volgorde", "Nagekeken"]
+GRID_STUDENTS = [50, 500, 5000]
+GRID_QUESTIONS = [20, 100, 400]
+
+
+def generate_export(filename, students=400, questions=120, seed=0, units=5, learning_goals=10,
+                    multiple_choice=1.0, invalid=0.0):
+    """Writes a synthetic Surpass export with the given number of students and questions.
+
+    Every student has an ability and every question a difficulty, so scores correlate like in a real
+    exam. A multiple_choice fraction of the questions are multiple choice questions with options A to
+    D scoring 1 point, the others are open questions scoring up to 3 points. An invalid fraction of the
+    students did not take the exam: their rows are marked Ongeldig and their answers are not checked.
+    """
+
+    rng = random.Random(seed)
+    question_ids = [f"{1000 + q}P{5000 + q}" for q in range(questions)]
+    difficulties = [rng.gauss(0, 1) for _ in question_ids]
+    multiple_choice_questions = set(rng.sample(range(questions), round(multiple_choice * questions)))
+    max_scores = [1 if q in multiple_choice_questions else 3 for q in range(questions)]
+    keys = [rng.choice("ABCD") if q in multiple_choice_questions else "" for q in range(questions)]
+    header = list(STUDENT_COLUMNS)
+    for question_id in question_ids:
+        header += [f"{column} [{question_id}]" for column in QUESTION_COLUMNS]
+    with open(filename, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header)
+        for student in range(students):
+            valid = rng.random() >= invalid
+            ability = rng.gauss(0, 1)
+            order = rng.sample(range(1, questions + 1), questions)
+            marks = []
+            responses = []
+            for q in range(questions):
+                probability = 1 / (1 + math.exp(difficulties[q] - ability))
+                if not valid:
+                    marks.append(0)
+                    responses.append("")
+                elif q in multiple_choice_questions:
+                    correct = rng.random() < probability
+                    marks.append(int(correct))
+                    responses.append(keys[q] if correct else rng.choice([c for c in "ABCD" if c != keys[q]]))
+                else:
+                    marks.append(sum(rng.random() < probability for _ in range(max_scores[q])))
+                    responses.append(f"Antwoord {student}")
+            row = [str(100000 + student), f"Voornaam{student}", f"Achternaam{student}", rng.choice("MV"),
+                   f"{student:08d}", str(sum(marks)), str(sum(max_scores)),
+                   ("Voldoende" if sum(marks) >= sum(max_scores) / 2 else "Onvoldoende") if valid else "Ongeldig",
+                   "Toetsformulier", "Toets", "Centrum", "Onderwerp"]
+            for q, question_id in enumerate(question_ids):
+                if q in multiple_choice_questions:
+                    row += [f"Vraag {q + 1}", "1", keys[q], "Meerkeuzevraag", "Standaard"]
+                else:
+                    row += [f"Vraag {q + 1}", str(max_scores[q]), "", "Open vraag", "Handmatig"]
+                row += [f"LO {q % learning_goals}" if learning_goals else "", f"Unit {q % units}" if units else "", ""]
+                row += [str(marks[q]), responses[q], str(rng.randint(5, 120) if valid else 0), str(order[q]),
+                        "Ja" if valid else "Nee"]
+            writer.writerow(row)
+
+
+def benchmark_read_csv(filename, repeat=3):
+    """Returns the best number of rows per second read_csv achieves on filename."""
+
+    with open(filename, newline="") as csvfile:
+        rows = sum(1 for _ in csvfile) - 1
+    best = None
+    for _ in range(repeat):
+        db = surparser.open_database(":memory:")
+        start = time.perf_counter()
+        surparser.read_csv(filename, db.cursor())
+        db.commit()
+        elapsed = time.perf_counter() - start
+        db.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return rows / best
+
+
+def benchmark_bulk_load(filename, repeat=3):
+    """Returns the best number of rows per second bulk_load achieves on filename."""
+
+    with open(filename, newline="") as csvfile:
+        rows = sum(1 for _ in csvfile) - 1
+    best = None
+    for _ in range(repeat):
+        db = surparser.open_database(":memory:")
+        start = time.perf_counter()
+        surparser.bulk_load(db, filename)
+        elapsed = time.perf_counter() - start
+        db.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return rows / best
+
+
+def time_phases(filename, cesuur=55.0, plot=False):
+    """Runs run() with all sections on filename and returns the seconds of every top-level span of its profile."""
+
+    import numpy  # loaded lazily by surparser; keep the import out of the first phase that needs it
+
+    with tempfile.TemporaryDirectory() as plot_dir:
+        argv = ["--all", "--cesuur", str(cesuur), "--input", filename, "--output", os.devnull]
+        if plot:
+            argv += ["--plot", "--plot-dir", plot_dir]
+        profile = surparser.run(surparser.get_argument_parser().parse_args(argv))
+    return {span.name: span.seconds for span in profile.spans if span.parent is None}
+
+
+def best_phases(filename, repeat=3, plot=False):
+    """Returns the best time of every phase over repeat runs."""
+
+    runs = [time_phases(filename, plot=plot) for _ in range(repeat)]
+    return {phase: min(timings[phase] for timings in runs) for phase in runs[0]}
+
+
+def import_time(module="surparser", repeat=5):
+    """Returns the best cumulative import time of module in milliseconds, as reported by python -X importtime.
+
+    python -X importtime requires Python 3.7 or later.
+    """
+
+    best = None
+    for _ in range(repeat):
+        stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.PIPE,
+                                universal_newlines=True, check=True).stderr
+        for line in stderr.splitlines():
+            _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            if name == module:
+                milliseconds = int(cumulative) / 1000
+        best = milliseconds if best is None else min(best, milliseconds)
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current, output):
+    """Prints the ratio of current to previous time of every phase measured in both result files."""
+
+    previous_results = {(result["students"], result["questions"]): result for result in previous["results"]}
+    print("Grootte | Fase | Vorige (s) | Huidige (s) | Factor", file=output)
+    print("------- | ---- | ---------:| ----------:| -----:", file=output)
+    for result in current["results"]:
+        before = previous_results.get((result["students"], result["questions"]))
+        if before is None:
+            continue
+        for phase, seconds in result["phases"].items():
+            if phase in before["phases"] and before["phases"][phase] > 0:
+                print("{}x{} | {} | {:.3f} | {:.3f} | {:.2f}".format(
+                    result["students"], result["questions"], phase, before["phases"][phase], seconds,
+                    seconds / before["phases"][phase]), file=output)
+
+
+def size(value):
+    """Parses studentsxquestions, for example 500x100."""
+
+    try:
+        students, questions = map(int, value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected studentsxquestions, got {value!r}")
+    return students, questions
+
+
+def get_argument_parser():
+    argumentParser = argparse.ArgumentParser(description="Benchmarks read_csv, bulk_load and the phases of run() "
+                                                         "on synthetic exports")
+    argumentParser.add_argument("--compare",
+                                help="Print the ratio of every phase to the results in this JSON file",
+                                metavar="results.json",
+                                type=argparse.FileType("r")
+                                )
+    argumentParser.add_argument("--grid",
+                                action="store_true",
+                                help="Benchmark all combinations of {} students and {} questions".format(
+                                    GRID_STUDENTS, GRID_QUESTIONS)
+                                )
+    argumentParser.add_argument("--invalid",
+                                default=0.0,
+                                help="Fraction of Ongeldig students (defaults to 0)",
+                                type=float
+                                )
+    argumentParser.add_argument("--json",
+                                help="Write the results to this JSON file",
+                                metavar="results.json",
+                                type=argparse.FileType("w")
+                                )
+    argumentParser.add_argument("--learning-goals",
+                                default=10,
+                                dest="learning_goals",
+                                help="Number of learning goals (defaults to 10)",
+                                type=int
+                                )
+    argumentParser.add_argument("--max-import-ms",
+                                dest="max_import_ms",
+                                help="Fail when importing surparser takes longer than this many milliseconds",
+                                type=float
+                                )
+    argumentParser.add_argument("--multiple-choice",
+                                default=1.0,
+                                dest="multiple_choice",
+                                help="Fraction of multiple choice questions (defaults to 1)",
+                                type=float
+                                )
+    argumentParser.add_argument("--plot",
+                                action="store_true",
+                                help="Also time collecting and rendering the plots"
+                                )
+    argumentParser.add_argument("--questions",
+                                default=120,
+                                help="Number of questions in the synthetic export (defaults to 120)",
+                                type=int
+                                )
+    argumentParser.add_argument("--repeat",
+                                default=3,
+                                help="Number of runs of which the best is reported (defaults to 3)",
+                                type=int
+                                )
+    argumentParser.add_argument("--sizes",
+                                help="Sizes to benchmark instead of --students and --questions",
+                                metavar="studentsxquestions",
+                                nargs="+",
+                                type=size
+                                )
+    argumentParser.add_argument("--students",
+                                default=400,
+                                help="Number of students in the synthetic export (defaults to 400)",
+                                type=int
+                                )
+    argumentParser.add_argument("--units",
+                                default=5,
+                                help="Number of units (defaults to 5)",
+                                type=int
+                                )
+    return argumentParser
+
+
+if __name__ == "__main__":
+    arguments = get_argument_parser().parse_args()
+    milliseconds = import_time() if sys.version_info >= (3, 7) else None
+    if milliseconds is not None:
+        print("import surparser: {:.1f} ms".format(milliseconds))
+    if arguments.max_import_ms is not None and milliseconds is not None and milliseconds > arguments.max_import_ms:
+        sys.exit(f"importing surparser took {milliseconds:.1f} ms, more than {arguments.max_import_ms} ms")
+    if arguments.grid:
+        sizes = list(itertools.product(GRID_STUDENTS, GRID_QUESTIONS))
+    else:
+        sizes = arguments.sizes or [(arguments.students, arguments.questions)]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for students, questions in sizes:
+            filename = os.path.join(directory, f"ItemsDeliveredRawReport-{students}x{questions}.csv")
+            generate_export(filename, students, questions, units=arguments.units,
+                            learning_goals=arguments.learning_goals, multiple_choice=arguments.multiple_choice,
+                            invalid=arguments.invalid)
+            result = {
+                "students": students,
+                "questions": questions,
+                "read_csv_rows_per_second": benchmark_read_csv(filename, arguments.repeat),
+                "bulk_load_rows_per_second": benchmark_bulk_load(filename, arguments.repeat),
+                "phases": best_phases(filename, arguments.repeat, arguments.plot)
+            }
+            print(f"{students} studenten x {questions} vragen")
+            print("  read_csv:  {:.0f} rows/s".format(result["read_csv_rows_per_second"]))
+            print("  bulk_load: {:.0f} rows/s".format(result["bulk_load_rows_per_second"]))
+            for phase, seconds in result["phases"].items():
+                print("  {:<15} {:.3f} s".format(phase, seconds))
+            results.append(result)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "import_ms": milliseconds,
+        "generator": {"units": arguments.units, "learning_goals": arguments.learning_goals,
+                      "multiple_choice": arguments.multiple_choice, "invalid": arguments.invalid},
+        "results": results
+    }
+    if arguments.json:
+        json.dump(report, arguments.json, indent=2)
+        arguments.json.close()
+    if arguments.compare:
+        compare(json.load(arguments.compare), report, sys.stdout)
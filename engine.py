@@ -0,0 +1,268 @@
+"""An in-memory engine that keeps an export in NumPy arrays instead of SQLite.
+
+ArrayExam loads the answers into students × questions matrices of scores,
+checked answers, Weergavetijd and Volgorde, and interns the item types, units
+and learning goals of the questions as integer codes. It implements the
+report queries of surparser as vectorized reductions over these arrays, with
+the same rows in the same order as the SQL queries. surparser passes an
+ArrayExam wherever it would pass a connection or cursor; the report functions
+that have a method of the same name here call that method instead.
+
+Select it with --engine numpy. The sections that need the individual
+answers, --distribution and --student-detail, are only available with SQLite.
+"""
+
+import csv
+from operator import itemgetter
+
+import numpy as np
+
+from surparser import (ANSWER_COLUMNS, ScoreMatrix, StudentScores, TimeMatrix, column_plan, question_params,
+                       student_params, toets_params)
+
+UNSUPPORTED_ARGUMENTS = ["all", "append", "bulk_load", "cache_dir", "distribution", "explain", "export",
+                         "student_detail"]
+
+
+def unsupported_arguments(arguments):
+    """Returns the options given in arguments that the numpy engine does not support."""
+
+    options = ["--" + name.replace("_", "-") for name in UNSUPPORTED_ARGUMENTS if getattr(arguments, name)]
+    if arguments.db != ":memory:":
+        options.append("--db")
+    return options
+
+
+def integer_affinity(value):
+    """Converts value the way SQLite stores it in a column with INTEGER affinity."""
+
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                value = float(value)
+            except ValueError:
+                return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def intern(values):
+    """Returns the sorted distinct values, NULL (None) first like SQL sorts it, and the code of every value."""
+
+    labels = sorted(set(values) - {None})
+    if None in values:
+        labels.insert(0, None)
+    index = {label: code for code, label in enumerate(labels)}
+    return labels, np.array([index[value] for value in values], dtype=np.intp)
+
+
+def getter(indexes):
+    """Returns a function that returns the fields at indexes of a row as a tuple."""
+
+    if len(indexes) == 1:
+        return lambda row: (row[indexes[0]],)
+    return itemgetter(*indexes) if indexes else lambda row: ()
+
+
+def numbers(values, dtype=float):
+    """Converts strings to an array of numbers; strings that are not a number become NaN."""
+
+    try:
+        return np.array(values, dtype=dtype)
+    except ValueError:
+        def number(value):
+            try:
+                return float(value)
+            except ValueError:
+                return float("nan")
+
+        return np.array([number(value) for value in values], dtype=dtype)
+
+
+def marks(values):
+    """Converts marks to an array of numbers, reading a decimal comma like 0,5 as a decimal point.
+
+    Also returns which marks had a decimal comma: SQLite sums only the number before the comma.
+    """
+
+    try:
+        return np.array(values, dtype=float), np.zeros(len(values), dtype=bool)
+    except ValueError:
+        commas = np.array(["," in value for value in values], dtype=bool)
+        return numbers([value.replace(",", ".") for value in values]), commas
+
+
+def descending(rows, key):
+    """Sorts rows on key like SQLite sorts DESC: NULL (None) last and ties in reverse of their current order."""
+
+    return sorted(reversed(rows), key=lambda row: tuple((value is not None, value) for value in key(row)),
+                  reverse=True)
+
+
+class ArrayExam:
+    """An export held in NumPy arrays, with the report queries of surparser as methods.
+
+    The matrices have a row per student and a column per question; scores is 0 where
+    the answer was not checked. It also stands in for the sqlite3 connection and cursor
+    in surparser.write_report.
+
+    The score and time matrices read marks with a decimal comma as numbers, like
+    surparser.score_matrix; the sums of the other sections take only the number before
+    the comma, like SQLite's SUM does.
+    """
+
+    def __init__(self, students, questions, toets, scores, commas, checked, times, order):
+        self.referenties, self.first_names, self.last_names, self.markings, self.totals = (
+            map(list, zip(*students)) if students else ([], [], [], [], []))
+        (self.question_ids, self.names, max_scores, self.keys, item_types, _, learning_goals, units, _) = (
+            map(list, zip(*questions)) if questions else ([],) * 9)
+        self.max_scores = [integer_affinity(max_score) for max_score in max_scores]
+        self.item_type_labels, self.item_type_codes = intern(item_types)
+        self.unit_labels, self.unit_codes = intern(units)
+        self.learning_goal_labels, self.learning_goal_codes = intern(learning_goals)
+        self.toets = toets
+        self.scores = np.where(checked, np.nan_to_num(scores), 0.0)
+        self.commas = commas & checked
+        self.checked = checked
+        self.times = times
+        self.order = order
+        self.total_changes = len(students) + len(questions) + checked.size
+        self.answers = self.checked.sum(axis=0)
+        self.question_totals = self.summed(self.scores, self.commas).sum(axis=0)
+
+    @classmethod
+    def load(cls, input_filename):
+        """Reads an ItemsDeliveredRawReport.csv like read_csv: later rows of a student replace earlier ones."""
+
+        with open(input_filename, newline="") as csvfile:
+            reader = csv.reader(csvfile)
+            plan = column_plan(next(reader, []))
+            fields = [getter([question.answer[column] for question in plan.questions])
+                      for column in range(len(ANSWER_COLUMNS))]
+            marking, _, time, order, nagekeken = fields
+            rows, students, toetsen, questions = {}, {}, {}, None
+            for row in reader:
+                if not row:
+                    continue
+                referentie, voornaam, achternaam, _, _, markering, totaalscore, _ = student_params(plan, row)
+                referentie = integer_affinity(referentie)
+                students[referentie] = (referentie, voornaam, achternaam, integer_affinity(markering),
+                                        integer_affinity(totaalscore))
+                toetsformulier, toets, _, _, totaalscore = toets_params(plan, row)
+                toetsen[toetsformulier] = (toetsformulier, toets, integer_affinity(totaalscore))
+                if questions is None and row[plan.cijfer] != "Ongeldig":
+                    questions = list(question_params(plan, row))
+                rows[referentie] = (*marks(marking(row)), np.array(nagekeken(row)) == "Ja",
+                                    numbers(time(row), np.float32), numbers(order(row), np.float32))
+        # Without a valid row there are no questions, so no answer joins a question
+        columns = len(plan.questions) if questions else 0
+        matrices = [np.array([values[:columns] for values in matrix]).reshape(len(rows), columns)
+                    for matrix in zip(*rows.values())] if rows else [np.zeros((0, 0))] * 5
+        return cls(list(students.values()), questions or [], next(iter(toetsen.values()), None), *matrices)
+
+    @staticmethod
+    def summed(scores, commas):
+        """Returns the scores the way SQLite sums them: of a mark with a decimal comma only the whole number."""
+
+        return np.where(commas, np.trunc(scores), scores)
+
+    def cursor(self):
+        return self
+
+    def set_trace_callback(self, callback):
+        """The arrays are queried without SQL, so there are no statements to trace."""
+
+    def close(self):
+        pass
+
+    def get_toetsformulier(self):
+        return self.toets
+
+    def student_scores(self):
+        students = np.flatnonzero(self.checked.any(axis=1))
+        students = sorted(students, key=lambda student: (isinstance(self.referenties[student], str),
+                                                         self.referenties[student]))
+        students = descending(students, lambda student: (self.markings[student],))
+        markings = [self.markings[student] for student in students]
+        return StudentScores([self.first_names[student] for student in students],
+                             [self.last_names[student] for student in students],
+                             markings, np.array(markings, dtype=float),
+                             np.array([self.totals[student] for student in students], dtype=float))
+
+    def percentages(self, sums, totals):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percentages = 100.0 * sums / totals
+        return [float(percentage) if np.isfinite(percentage) else None for percentage in percentages]
+
+    def grouped(self, labels, codes, answers, question_totals):
+        """Returns (label, questions, percentage) of the groups of questions with checked answers."""
+
+        max_scores = np.array(self.max_scores, dtype=float)
+        questions = np.bincount(codes, (answers > 0).astype(float), len(labels)).astype(int)
+        percentages = self.percentages(np.bincount(codes, question_totals, len(labels)),
+                                       np.bincount(codes, answers * max_scores, len(labels)))
+        return [(label, int(count), percentage)
+                for label, count, percentage in zip(labels, questions, percentages) if count > 0]
+
+    def student_columns(self, referentie):
+        """Returns the number of checked answers and the total score per question, of one student or all."""
+
+        if not referentie:
+            return self.answers, self.question_totals
+        student = self.referenties.index(integer_affinity(referentie))
+        return self.checked[student].astype(int), self.summed(self.scores[student], self.commas[student])
+
+    def answer_score(self):
+        percentages = self.percentages(self.question_totals, self.answers * np.array(self.max_scores, dtype=float))
+        rows = sorted((question_id, name, max_score, percentage)
+                      for question_id, name, max_score, percentage, answers
+                      in zip(self.question_ids, self.names, self.max_scores, percentages, self.answers) if answers)
+        return [row[1:] for row in descending(rows, lambda row: (row[3],))]
+
+    def item_types(self):
+        rows = self.grouped(self.item_type_labels, self.item_type_codes, self.answers, self.question_totals)
+        return descending(rows, lambda row: (row[2],))
+
+    def units(self):
+        return [(unit,) for unit in self.unit_labels if unit is not None]
+
+    def unit_results(self, referentie=None):
+        rows = self.grouped(self.unit_labels, self.unit_codes, *self.student_columns(referentie))
+        return descending(rows, lambda row: (row[2], row[0]))
+
+    def learning_goals(self, referentie=None):
+        rows = self.grouped(self.learning_goal_labels, self.learning_goal_codes, *self.student_columns(referentie))
+        return descending([row for row in rows if row[0] is not None], lambda row: (row[2], row[0]))
+
+    def question_scores(self, question):
+        """Returns (score, count) of the checked answers to a question, ordered by score."""
+
+        values, counts = np.unique(self.scores[self.checked[:, question], question], return_counts=True)
+        return [(integer_affinity(float(value)), int(count)) for value, count in zip(values, counts)]
+
+    def unit_distribution(self, unit):
+        for question, (name, question_unit) in enumerate(zip(self.names, self.unit_codes)):
+            if self.unit_labels[question_unit] == unit:
+                yield name, self.question_scores(question)
+
+    def question_distribution(self):
+        for question, name in enumerate(self.names):
+            yield name, self.question_scores(question)
+
+    def score_matrix(self):
+        students = np.flatnonzero(self.checked.any(axis=1))
+        referenties = np.array([self.referenties[student] for student in students], dtype=np.int64)
+        order = np.argsort(referenties, kind="stable")
+        return ScoreMatrix(referenties[order], self.names, np.array(self.max_scores, dtype=float),
+                           self.scores[students[order]])
+
+    def time_matrix(self):
+        students = self.checked.any(axis=1)
+        checked = self.checked[students]
+        return TimeMatrix(self.names, np.array(self.max_scores, dtype=float),
+                          np.where(checked, self.scores[students], np.nan),
+                          np.where(checked, self.times[students], np.nan).astype(float),
+                          np.where(checked, self.order[students], np.nan).astype(float))
@@ -0,0 +1,87 @@
+"""Exports the normalized tables of surparser for analytics jobs.
+
+Every table is written to its own file in the export directory, either as
+newline-delimited JSON or as Parquet. Rows are read from the database and
+written in chunks, so the size of an export is not limited by memory.
+Parquet requires pyarrow, which is imported only when it is used.
+"""
+
+import json
+import os
+
+EXPORT_TABLES = ["Toets", "Student", "Question", "Answer"]
+EXPORT_FORMATS = ["ndjson", "parquet"]
+CHUNK_SIZE = 10000
+
+
+def chunks(cursor, statement, chunk_size=CHUNK_SIZE):
+    """Yields the rows of statement in lists of at most chunk_size rows."""
+
+    cursor.execute(statement)
+    rows = cursor.fetchmany(chunk_size)
+    while rows:
+        yield rows
+        rows = cursor.fetchmany(chunk_size)
+
+
+def column_types(db, table):
+    """Returns the columns of table with the SQLite storage classes they contain.
+
+    The declared types of the schema are not enforced by SQLite, so empty
+    strings may occur in integer columns.
+    """
+
+    columns = [name for _, name, *_ in db.execute(f"PRAGMA table_info({table})")]
+    return [(column, {storage_class for storage_class, in db.execute(f"SELECT DISTINCT typeof({column}) FROM {table}")})
+            for column in columns]
+
+
+def export_ndjson(db, table, filename, chunk_size=CHUNK_SIZE):
+    columns = [column for column, _ in column_types(db, table)]
+    with open(filename, "w") as output:
+        for rows in chunks(db.cursor(), f"SELECT * FROM {table} ORDER BY rowid", chunk_size):
+            output.write("".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows))
+
+
+def arrow_type(storage_classes):
+    import pyarrow as pa
+
+    storage_classes = storage_classes - {"null"}
+    if storage_classes <= {"integer"}:
+        return pa.int64()
+    elif storage_classes <= {"integer", "real"}:
+        return pa.float64()
+    return pa.string()
+
+
+def export_parquet(db, table, filename, chunk_size=CHUNK_SIZE):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("--export-format parquet requires pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([(column, arrow_type(storage_classes)) for column, storage_classes in column_types(db, table)])
+    strings = [field.type == pa.string() for field in schema]
+    with pq.ParquetWriter(filename, schema) as writer:
+        for rows in chunks(db.cursor(), f"SELECT * FROM {table} ORDER BY rowid", chunk_size):
+            columns = [[value if value is None or not string else str(value) for value in column]
+                       for column, string in zip(zip(*rows), strings)]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, field.type) for column, field in zip(columns, schema)], schema=schema
+            ))
+
+
+EXPORTERS = {"ndjson": export_ndjson, "parquet": export_parquet}
+
+
+def export_tables(db, directory, export_format="ndjson", chunk_size=CHUNK_SIZE):
+    """Writes every table to directory/<table>.<export_format> and returns the filenames."""
+
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    for table in EXPORT_TABLES:
+        filename = os.path.join(directory, f"{table}.{export_format}")
+        EXPORTERS[export_format](db, table, filename, chunk_size)
+        filenames.append(filename)
+    return filenames
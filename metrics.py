@@ -0,0 +1,153 @@
+"""Counters, gauges and histograms in the Prometheus text exposition format.
+
+Metrics are kept in memory of the web process and rendered when /metrics is
+scraped, so recording one is a dictionary update under a lock. Gauges can be
+given a function that is only called at scrape time, and a collector registered
+with Registry.collector can set several gauges from one computation per scrape.
+"""
+
+import bisect
+import threading
+
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects the labels {', '.join(self.labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, self.labels, key, value) for key, value in sorted(self.values.items())]
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{format_labels(names, values)} {format_value(value)}"
+                  for name, names, values, value in self.samples()]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self.function = function
+        self.values[()] = 0
+
+    def set(self, value):
+        with self.lock:
+            self.values[()] = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.values[()] += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def value(self):
+        return self.function() if self.function is not None else self.values[()]
+
+    def samples(self):
+        return [(self.name, (), (), self.value())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = counts, total + value
+
+    def count(self, **labels):
+        counts, _ = self.values.get(self.key(labels), ([0], 0))
+        return sum(counts)
+
+    def samples(self):
+        with self.lock:
+            values = [(key, list(counts), total) for key, (counts, total) in sorted(self.values.items())]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((self.name + "_bucket", self.labels + ("le",), key + (format_value(bound),), cumulative))
+            samples.append((self.name + "_sum", self.labels, key, total))
+            samples.append((self.name + "_count", self.labels, key, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, function=None):
+        return self.register(Gauge(name, documentation, function))
+
+    def histogram(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def collector(self, function):
+        """Registers function to be called before every scrape, e.g. to set gauges that share a computation."""
+
+        self.collectors.append(function)
+        return function
+
+    def expose(self):
+        for collector in self.collectors:
+            collector()
+        return "".join(metric.expose() for metric in self.metrics)
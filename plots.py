@@ -0,0 +1,98 @@
+"""Plots for the report produced by surparser.
+
+This module imports matplotlib and is only imported by surparser when plots
+are requested, so text-only runs do not pay for loading it.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
+import numpy as np
+from mpl_toolkits.axes_grid1.axes_divider import make_axes_area_auto_adjustable
+
+
+def plot_marks(histogram, plot_dir='.', plot_extension="png"):
+    x = np.arange(1, 11)
+    fig, axes = plt.subplots()
+    axes.set(title="Student score",
+             xlabel="cijfer",
+             ylabel="aantal",
+             xticks=x)
+    axes.bar(x, histogram, align="center")
+    filename = os.path.join(plot_dir, f"student_score.{plot_extension}")
+    fig.savefig(filename)
+    plt.close()
+    return filename
+
+
+def plot_cesuur_sweep(sweep, plot_dir=".", plot_extension="png"):
+    fig, axes = plt.subplots()
+    axes.set(title="Cesuur analyse",
+             xlabel="cesuur (%)",
+             ylabel="slagingspercentage",
+             ylim=(0, 100))
+    axes.plot(sweep.cesuurs, sweep.pass_percentages, marker=".")
+    filename = os.path.join(plot_dir, f"cesuur_sweep.{plot_extension}")
+    fig.savefig(filename)
+    plt.close()
+    return filename
+
+
+def mark_levels(distribution):
+    """Returns all marks in the distribution in the order SQLite sorts them: numbers before text."""
+
+    return sorted({mark for _, marks in distribution for mark, _ in marks},
+                  key=lambda mark: (isinstance(mark, str), mark))
+
+
+def plot_unit(distribution, plot_dir, plot_extension, unit):
+    fig, axes = plt.subplots(figsize=(6.4, 0.85 + len(distribution) / 2))
+    axes.set(title=unit,
+             xlabel="aantal studenten",
+             ylabel="vraag")
+    names = [name for name, _ in distribution]
+    counts = [dict(marks) for _, marks in distribution]
+    left = np.zeros(len(distribution))
+    for mark in mark_levels(distribution):
+        widths = np.array([question_counts.get(mark, 0) for question_counts in counts], dtype=float)
+        axes.barh(names, widths, left=left, color=f"C{round(float(str(mark).replace(',', '.')))}")
+        for name, x, width in zip(names, left, widths):
+            if width > 0:
+                axes.text(x + width / 2, name, str(mark), verticalalignment="center")
+        left += widths
+    make_axes_area_auto_adjustable(axes)
+    filename = os.path.join(plot_dir, f"unit_{unit}.{plot_extension}")
+    fig.savefig(filename)
+    plt.close()
+    return unit, filename
+
+
+def render_in_worker(function, *arguments):
+    plt.switch_backend("Agg")
+    return timed_render(function, *arguments)
+
+
+def timed_render(function, *arguments):
+    start = time.perf_counter()
+    return function(*arguments), time.perf_counter() - start
+
+
+def render_plots(plots, jobs=None, timings=None):
+    """Renders the plots, a dict of key to (function, arguments), and returns a dict of key to result.
+
+    Unless jobs is 1 the plots are rendered in a pool of worker processes using the Agg backend.
+    If timings is a dict, the seconds spent rendering every plot are stored in it by key.
+    """
+
+    if jobs == 1 or len(plots) <= 1:
+        results = {key: timed_render(function, *arguments) for key, (function, arguments) in plots.items()}
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            futures = {key: executor.submit(render_in_worker, function, *arguments)
+                       for key, (function, arguments) in plots.items()}
+            results = {key: future.result() for key, future in futures.items()}
+    if timings is not None:
+        timings.update((key, seconds) for key, (_, seconds) in results.items())
+    return {key: result for key, (result, _) in results.items()}
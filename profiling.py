@@ -0,0 +1,78 @@
+"""Timing spans for a surparser run.
+
+A Profile records a span per phase of a run: its duration, the number of SQL
+statements executed in it and the number of rows it loaded or wrote to the
+report. run() fills it when --profile or --profile-json is given and the web
+service logs it for every conversion.
+"""
+
+import json
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from writers import Table
+
+Span = namedtuple("Span", ["name", "seconds", "queries", "rows", "parent"])
+
+
+class Profile:
+    def __init__(self):
+        self.spans = []
+        self.queries = 0
+        self.rows = 0
+
+    def trace(self, statement):
+        """Counts a statement; install it with db.set_trace_callback."""
+
+        self.queries += 1
+
+    @contextmanager
+    def span(self, name):
+        queries, rows = self.queries, self.rows
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append(Span(name, time.perf_counter() - start, self.queries - queries, self.rows - rows, None))
+
+    def add(self, name, seconds, parent=None):
+        """Records a span that was timed elsewhere, for example in a worker process, as part of parent."""
+
+        self.spans.append(Span(name, seconds, 0, 0, parent))
+
+    def writer(self, writer):
+        """Wraps a writer so the rows of the tables it writes are counted."""
+
+        return CountingWriter(writer, self)
+
+    def output_summary(self, output):
+        print("Fase | Tijd (s) | Queries | Rijen", file=output)
+        print("---- | --------:| -------:| -----:", file=output)
+        for span in self.spans:
+            name = span.name if span.parent is None else f"{span.parent} / {span.name}"
+            print(f"{name} | {span.seconds:.3f} | {span.queries} | {span.rows}", file=output)
+        spans = [span for span in self.spans if span.parent is None]
+        print("Totaal | {:.3f} | {} | {}".format(sum(span.seconds for span in spans),
+                                               sum(span.queries for span in spans),
+                                               sum(span.rows for span in spans)), file=output)
+
+    def summary_line(self):
+        return " ".join(f"{span.name}={span.seconds:.3f}s" for span in self.spans if span.parent is None)
+
+    def dump(self, output):
+        json.dump({"spans": [span._asdict() for span in self.spans]}, output, indent=2)
+        output.write("\n")
+
+
+class CountingWriter:
+    def __init__(self, writer, profile):
+        self.writer = writer
+        self.profile = profile
+
+    def write(self, section):
+        self.profile.rows += sum(len(block.rows) for block in section.blocks if isinstance(block, Table))
+        self.writer.write(section)
+
+    def close(self):
+        self.writer.close()
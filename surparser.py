@@ -3,7 +3,7 @@
 """Parser for ItemsDeliveredRawReport.csv file produced by Surpass.
 
 A markdown file is outputed with the sections you indicate with
-the optional arguments.
+the optional arguments. Use --format for HTML, CSV or JSON instead.
 
 Tip: if you want to produce a pdf use:
 ./surparser.py --all | pandoc -o surparser.pdf -f markdown
@@ -11,19 +11,31 @@ Tip: if you want to produce a pdf use:
 
 import argparse
 import csv
+import functools
+import hashlib
 import os
 import re
 import sqlite3
 import sys
-from functools import lru_cache
+import tempfile
+import textwrap
+import time
+from collections import namedtuple
+from itertools import groupby
+from operator import itemgetter
 
-import matplotlib.pyplot as plt
-import numpy as np
-from mpl_toolkits.axes_grid1.axes_divider import make_axes_area_auto_adjustable
+from export import EXPORT_FORMATS, export_tables
+from profiling import Profile
+from writers import WRITERS, Column, Heading, Image, Section, Strong, Table
 
+SCHEMA_VERSION = 2
 
-def open_database(filename):
-    """Opens the database pointed to by filename and creates the necessary tables."""
+
+def open_database(filename, clear=True):
+    """Opens the database pointed to by filename and creates the necessary tables.
+
+    Unless clear is False, all rows of an existing database are deleted.
+    """
 
     db = sqlite3.connect(filename)
     cursor = db.cursor()
@@ -39,7 +51,8 @@ def open_database(filename):
                 Cijfer CHAR(4)
         );
     """)
-    cursor.execute("DELETE FROM Student;")
+    if clear:
+        cursor.execute("DELETE FROM Student;")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS Toets(
             Toetsformulier TEXT NOT NULL PRIMARY KEY,
@@ -49,7 +62,8 @@ def open_database(filename):
             Totaalscore SMALLINT UNSIGNED
         );
     """)
-    cursor.execute("DELETE FROM Toets;")
+    if clear:
+        cursor.execute("DELETE FROM Toets;")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS Question(
             QuestionId CHAR(11) NOT NULL PRIMARY KEY,
@@ -63,7 +77,8 @@ def open_database(filename):
             Trefwoorden TEXT
         );
     """)
-    cursor.execute("DELETE FROM Question;")
+    if clear:
+        cursor.execute("DELETE FROM Question;")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS Vijanden(
             QuestionId CHAR(11) NOT NULL
@@ -77,7 +92,8 @@ def open_database(filename):
             PRIMARY KEY (QuestionId, EnymyId)
         );
     """)
-    cursor.execute("DELETE FROM Vijanden;")
+    if clear:
+        cursor.execute("DELETE FROM Vijanden;")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS Answer(
             QuestionId CHAR(11) NOT NULL
@@ -95,31 +111,149 @@ def open_database(filename):
             Nagekeken CHAR(3)
         );
     """)
-    cursor.execute("DELETE FROM Answer;")
+    if clear:
+        cursor.execute("DELETE FROM Answer;")
+    elif not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'AnswerKey'").fetchone():
+        # Databases from before the unique key may hold an answer more than once; keep the last one
+        cursor.execute("""
+            DELETE FROM Answer
+            WHERE rowid NOT IN (SELECT MAX(rowid) FROM Answer GROUP BY QuestionId, Referentie);
+        """)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS AnswerKey
+        ON Answer(QuestionId, Referentie);
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Source(
+            Md5 CHAR(32) NOT NULL PRIMARY KEY,
+            Filename TEXT,
+            Ingested TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    if clear:
+        cursor.execute("DELETE FROM Source;")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS AnswerQuestion
+        ON Answer(QuestionId, Nagekeken, DaadwerkelijkeMarkering);
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS AnswerStudent
+        ON Answer(Referentie, Nagekeken);
+    """)
+    db.commit()
     return db
 
 
+STUDENT_COLUMNS = ["Referentie", "Voornaam", "Achternaam", "Geslacht", "Sleutelcode", "Daadwerkelijke markering",
+                   "Totaalscore", "Cijfer"]
+TOETS_COLUMNS = ["Toetsformulier", "Toets", "Centrum", "Onderwerp", "Totaalscore"]
+QUESTION_COLUMNS = [("Naam", "Naam"), ("Totaalscore", "Totaalscore"), ("Sleutel", "Sleutel"),
+                    ("ItemType", "Itemtype"), ("ScoreType", "Scoretype"), ("LO", "LO"), ("Unit", "Unit"),
+                    ("Trefwoorden", "Trefwoorden")]
+OPTIONAL_QUESTION_COLUMNS = {"LO", "Unit", "Trefwoorden"}
+ANSWER_COLUMNS = [("DaadwerkelijkeMarkering", "Daadwerkelijke markering"), ("Reactie", "Reactie"),
+                  ("Weergavetijd", "Weergavetijd"), ("Volgorde", "Gepresenteerde volgorde"),
+                  ("Nagekeken", "Nagekeken")]
+
+BULK_LOAD_PRAGMAS = {"journal_mode": "MEMORY", "synchronous": "OFF", "cache_size": "-65536"}
+
+ColumnPlan = namedtuple("ColumnPlan", ["student", "toets", "cijfer", "questions"])
+QuestionColumns = namedtuple("QuestionColumns", ["question_id", "question", "answer"])
+
+
+def column_plan(header):
+    """Maps the header row once to the column indexes of the student, test and question fields."""
+
+    columns = {name: index for index, name in enumerate(header)}
+    questions = []
+    for key in columns:
+        name = re.match(r"Naam \[(.+)\]", key)
+        if name:
+            question_id = name.group(1)
+            questions.append(QuestionColumns(
+                question_id,
+                [columns.get("{} [{}]".format(column, question_id)) if field in OPTIONAL_QUESTION_COLUMNS
+                 else columns["{} [{}]".format(column, question_id)]
+                 for field, column in QUESTION_COLUMNS],
+                [columns.get("{} [{}]".format(column, question_id)) for field, column in ANSWER_COLUMNS]
+            ))
+    return ColumnPlan(
+        [columns.get(column) for column in STUDENT_COLUMNS],
+        [columns.get(column) for column in TOETS_COLUMNS],
+        columns.get("Cijfer"),
+        questions
+    )
+
+
+def student_params(plan, row):
+    referentie, voornaam, achternaam, geslacht, sleutelcode, markering, totaalscore, cijfer = (
+        row[index] for index in plan.student)
+    return (referentie, voornaam, achternaam, geslacht, sleutelcode, float(markering.replace(",", ".")),
+            totaalscore, cijfer)
+
+
+def toets_params(plan, row):
+    return tuple(row[index] for index in plan.toets)
+
+
+def question_params(plan, row):
+    for question in plan.questions:
+        yield (question.question_id,) + tuple(None if index is None else row[index] for index in question.question)
+
+
+def answer_params(plan, row):
+    referentie = row[plan.student[0]]
+    for question in plan.questions:
+        yield (question.question_id, referentie) + tuple(row[index] for index in question.answer)
+
+
+def upsert_statement(table, columns, key):
+    """Returns an INSERT that updates the row with the same key instead, but only when a value changed."""
+
+    updates = [column for column in columns if column not in key]
+    return """
+        INSERT INTO {table}({columns})
+        VALUES({values})
+        ON CONFLICT({key}) DO UPDATE SET {updates}
+        WHERE {changed};
+    """.format(
+        table=table,
+        columns=", ".join(columns),
+        values=", ".join("?" * len(columns)),
+        key=", ".join(key),
+        updates=", ".join(f"{column} = excluded.{column}" for column in updates),
+        changed=" OR ".join(f"{table}.{column} IS NOT excluded.{column}" for column in updates)
+    )
+
+
+STUDENT_UPSERT = upsert_statement("Student", ["Referentie", "Voornaam", "Achternaam", "Geslacht", "Sleutelcode",
+                                              "Daadwerkelijke_markering", "Totaalscore", "Cijfer"], ["Referentie"])
+TOETS_UPSERT = upsert_statement("Toets", ["Toetsformulier", "Toets", "Centrum", "Onderwerp", "Totaalscore"],
+                                ["Toetsformulier"])
+QUESTION_UPSERT = upsert_statement("Question", ["QuestionId", "Naam", "Totaalscore", "Sleutel", "ItemType",
+                                                "ScoreType", "LO", "Unit", "Trefwoorden"], ["QuestionId"])
+ANSWER_UPSERT = upsert_statement("Answer", ["QuestionId", "Referentie", "DaadwerkelijkeMarkering", "Reactie",
+                                            "Weergavetijd", "Volgorde", "Nagekeken"], ["QuestionId", "Referentie"])
+
+
 def insert_student(cursor, params):
-    params["Daadwerkelijke_markering"] = float(params["Daadwerkelijke markering"].replace(",", "."))
-    del params["Daadwerkelijke markering"]
-    return cursor.execute("""
-        INSERT OR REPLACE INTO Student(Referentie, Voornaam, Achternaam, Geslacht, Sleutelcode, Daadwerkelijke_markering, Totaalscore, Cijfer)
-        VALUES(:Referentie, :Voornaam, :Achternaam, :Geslacht, :Sleutelcode, :Daadwerkelijke_markering, :Totaalscore, :Cijfer);
-    """, params)
+    return insert_students(cursor, [params])
+
+
+def insert_students(cursor, params):
+    return cursor.executemany(STUDENT_UPSERT, params)
 
 
 def insert_toetsformulier(cursor, params):
-    return cursor.execute("""
-        INSERT OR REPLACE INTO Toets(Toetsformulier, Toets, Centrum, Onderwerp, Totaalscore)
-        VALUES(:Toetsformulier, :Toets, :Centrum, :Onderwerp, :Totaalscore)
-    """, params)
+    return insert_toetsformulieren(cursor, [params])
+
+
+def insert_toetsformulieren(cursor, params):
+    return cursor.executemany(TOETS_UPSERT, params)
 
 
 def insert_question(cursor, params):
-    return cursor.executemany("""
-        INSERT OR REPLACE INTO Question(QuestionId, Naam, Totaalscore, Sleutel, ItemType, ScoreType, LO, Unit, Trefwoorden)
-        VALUES(:QuestionId, :Naam, :Totaalscore, :Sleutel, :ItemType, :ScoreType, :LO, :Unit, :Trefwoorden);
-    """, parse_question_params(params))
+    return cursor.executemany(QUESTION_UPSERT, params)
 
 
 def insert_vijanden(cursor, params):
@@ -127,54 +261,187 @@ def insert_vijanden(cursor, params):
 
 
 def insert_answer(cursor, params):
-    return cursor.executemany("""
-        INSERT OR REPLACE INTO Answer(QuestionId, Referentie, DaadwerkelijkeMarkering, Reactie, Weergavetijd, Volgorde, Nagekeken)
-        VALUES(:QuestionId, :Referentie, :DaadwerkelijkeMarkering, :Reactie, :Weergavetijd, :Volgorde, :Nagekeken);
-    """, parse_answer_params(params))
+    return cursor.executemany(ANSWER_UPSERT, params)
 
 
 def parse_question_params(params):
-    for key in params:
-        name = re.match(r"Naam \[(.+)\]", key)
-        if name:
-            question_id = name.group(1)
-            if params["Cijfer"] != "Ongeldig":
-                yield {
-                    "QuestionId": question_id,
-                    "Naam": params[key],
-                    "Totaalscore": params["Totaalscore [{}]".format(question_id)],
-                    "Sleutel": params["Sleutel [{}]".format(question_id)],
-                    "ItemType": params["Itemtype [{}]".format(question_id)],
-                    "ScoreType": params["Scoretype [{}]".format(question_id)],
-                    "LO": params.get("LO [{}]".format(question_id), None),
-                    "Unit": params.get("Unit [{}]".format(question_id), None),
-                    "Trefwoorden": params.get("Trefwoorden [{}]".format(question_id), None)
-                }
+    plan = column_plan(list(params))
+    row = [params[key] for key in params]
+    if plan.questions and row[plan.cijfer] != "Ongeldig":
+        for values in question_params(plan, row):
+            yield dict(zip(["QuestionId"] + [field for field, column in QUESTION_COLUMNS], values))
 
 
 def parse_answer_params(params):
-    for key in params:
-        name = re.match(r"Naam \[(.+)\]", key)
-        if name:
-            question_id = name.group(1)
-            yield {
-                "QuestionId": question_id,
-                "Referentie": params["Referentie"],
-                "DaadwerkelijkeMarkering": params["Daadwerkelijke markering [{}]".format(question_id)],
-                "Reactie": params["Reactie [{}]".format(question_id)],
-                "Weergavetijd": params["Weergavetijd [{}]".format(question_id)],
-                "Volgorde": params["Gepresenteerde volgorde [{}]".format(question_id)],
-                "Nagekeken": params["Nagekeken [{}]".format(question_id)]
-            }
+    plan = column_plan(list(params))
+    row = [params[key] for key in params]
+    for values in answer_params(plan, row):
+        yield dict(zip(["QuestionId", "Referentie"] + [field for field, column in ANSWER_COLUMNS], values))
 
 
 def read_csv(input_filename, cursor):
     with open(input_filename, newline="") as csvfile:
-        for row in csv.DictReader(csvfile):
-            for func in [insert_student, insert_toetsformulier, insert_question, insert_vijanden, insert_answer]:
-                func(cursor, row)
+        reader = csv.reader(csvfile)
+        plan = column_plan(next(reader, []))
+        questions_inserted = False
+        for row in reader:
+            if not row:
+                continue
+            insert_student(cursor, student_params(plan, row))
+            insert_toetsformulier(cursor, toets_params(plan, row))
+            if not questions_inserted and row[plan.cijfer] != "Ongeldig":
+                insert_question(cursor, question_params(plan, row))
+                questions_inserted = True
+            insert_vijanden(cursor, row)
+            insert_answer(cursor, answer_params(plan, row))
+
+
+def bulk_load(db, input_filename):
+    """Loads the CSV with a few large executemany calls in a single transaction.
+
+    The PRAGMAs in BULK_LOAD_PRAGMAS are in effect while loading and restored afterwards.
+    Returns a list of (phase, seconds) tuples.
+    """
+
+    timings = []
+    start = time.perf_counter()
+    students, toetsen, questions, answers = [], {}, [], []
+    with open(input_filename, newline="") as csvfile:
+        reader = csv.reader(csvfile)
+        plan = column_plan(next(reader, []))
+        for row in reader:
+            if not row:
+                continue
+            students.append(student_params(plan, row))
+            toets = toets_params(plan, row)
+            toetsen[toets[0]] = toets
+            if not questions and row[plan.cijfer] != "Ongeldig":
+                questions = list(question_params(plan, row))
+            answers.extend(answer_params(plan, row))
+    timings.append(("parse", time.perf_counter() - start))
+
+    db.commit()
+    previous = {pragma: db.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in BULK_LOAD_PRAGMAS}
+    try:
+        for pragma, value in BULK_LOAD_PRAGMAS.items():
+            db.execute(f"PRAGMA {pragma} = {value}")
+        start = time.perf_counter()
+        cursor = db.cursor()
+        cursor.execute("BEGIN")
+        try:
+            insert_students(cursor, students)
+            insert_toetsformulieren(cursor, toetsen.values())
+            insert_question(cursor, questions)
+            insert_answer(cursor, answers)
+            timings.append(("insert", time.perf_counter() - start))
+            start = time.perf_counter()
+            db.commit()
+            timings.append(("commit", time.perf_counter() - start))
+        except BaseException:
+            db.rollback()
+            raise
+    finally:
+        for pragma, value in previous.items():
+            db.execute(f"PRAGMA {pragma} = {value}")
+    return timings
+
+
+def file_md5(filename):
+    md5 = hashlib.md5()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def ingest(db, input_filename, load, digest=None):
+    """Loads input_filename into db unless a file with the same md5 was ingested before.
+
+    The md5 is recorded in the Source table after loading. Loading upserts, so should a run
+    stop in between, ingesting the file again is harmless. Returns whether the file was loaded.
+    """
+
+    digest = digest or file_md5(input_filename)
+    if db.execute("SELECT 1 FROM Source WHERE Md5 = ?", (digest,)).fetchone():
+        return False
+    load(db, input_filename)
+    db.execute("INSERT INTO Source(Md5, Filename) VALUES(?, ?)", (digest, os.path.basename(input_filename)))
+    db.commit()
+    return True
+
+
+def cached_database(cache_dir, input_filename, load, max_size, digest=None):
+    """Returns the cached database of input_filename and whether it was a cache hit.
+
+    Cache entries are keyed by the md5 of the CSV and the SCHEMA_VERSION. On a miss the
+    database is filled by calling load(db, input_filename) and least recently used entries
+    are evicted until the cache is at most max_size bytes.
+    """
+
+    filename = os.path.join(cache_dir, "{}-v{}.db".format(digest or file_md5(input_filename), SCHEMA_VERSION))
+    if os.path.exists(filename):
+        os.utime(filename)
+        return open_database(filename, clear=False), True
+    os.makedirs(cache_dir, exist_ok=True)
+    handle, temporary_filename = tempfile.mkstemp(".tmp", os.path.basename(filename) + ".", cache_dir)
+    os.close(handle)
+    try:
+        db = open_database(temporary_filename)
+        try:
+            load(db, input_filename)
+        finally:
+            db.close()
+    except BaseException:
+        os.remove(temporary_filename)
+        raise
+    os.replace(temporary_filename, filename)
+    evict_cache(cache_dir, max_size, keep=filename)
+    return open_database(filename, clear=False), False
+
+
+def evict_cache(cache_dir, max_size, keep=None):
+    """Removes the least recently used databases until the cache is at most max_size bytes.
+
+    Other processes may evict the same cache at the same time, so databases that are
+    already gone are skipped.
+    """
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".db"):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(cache_dir, name)))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, filename in sorted(entries):
+        if total_size <= max_size:
+            break
+        if filename != keep:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+def dispatch(function):
+    """Lets an engine that stands in for the connection or cursor compute function itself.
+
+    When the first argument has a method named like function, such as the ArrayExam of
+    engine.py, that method is called with the other arguments instead of running the SQL.
+    """
 
+    @functools.wraps(function)
+    def dispatcher(cursor, *arguments):
+        method = getattr(cursor, function.__name__, None)
+        return function(cursor, *arguments) if method is None else method(*arguments)
 
+    return dispatcher
+
+
+@dispatch
 def answer_score(cursor):
     return cursor.execute("""
         SELECT Naam, Totaalscore, 100.0 * SUM(DaadwerkelijkeMarkering) / SUM(Totaalscore) AS percentage
@@ -186,31 +453,234 @@ def answer_score(cursor):
     """)
 
 
-def student_score(cursor, cesuur=None):
-    cursor.execute("""
+StudentScores = namedtuple("StudentScores", ["first_names", "last_names", "markings", "scores", "totals"])
+
+
+@dispatch
+def student_scores(cursor):
+    """Loads the names and scores of all students, ordered by descending score.
+
+    The scores and total scores are NumPy arrays so they can be passed to mark_array.
+    """
+
+    import numpy as np
+
+    rows = cursor.execute("""
         SELECT Voornaam, Achternaam, Daadwerkelijke_markering, Totaalscore
         FROM Student
         NATURAL JOIN Answer
         WHERE Nagekeken = 'Ja'
         GROUP BY Referentie
         ORDER BY Daadwerkelijke_markering DESC
-    """)
-    for first_name, last_name, actual_score, total_score in cursor:
-        if cesuur is None:
-            yield first_name, last_name, actual_score, 100.0 * actual_score / total_score
-        else:
-            yield first_name, last_name, actual_score, 100.0 * actual_score / total_score, mark(actual_score, cesuur,
-                                                                                                total_score)
+    """).fetchall()
+    first_names, last_names, markings, totals = map(list, zip(*rows)) if rows else ([], [], [], [])
+    return StudentScores(first_names, last_names, markings, np.array(markings, dtype=float),
+                         np.array(totals, dtype=float))
+
+
+def student_score(cursor, cesuur=None, scores=None):
+    if scores is None:
+        scores = student_scores(cursor)
+    percentages = 100.0 * scores.scores / scores.totals
+    if cesuur is None:
+        yield from zip(scores.first_names, scores.last_names, scores.markings, percentages)
+    else:
+        yield from zip(scores.first_names, scores.last_names, scores.markings, percentages,
+                       mark_array(scores.scores, cesuur, scores.totals))
+
+
+def pass_percentage(scores, cesuur):
+    import numpy as np
+
+    return 100.0 * np.count_nonzero(mark_array(scores.scores, cesuur, scores.totals) >= 5.5) / len(scores.scores)
+
+
+CesuurSweep = namedtuple("CesuurSweep", ["cesuurs", "pass_percentages", "mean_marks", "histograms"])
+
+
+def cesuur_sweep(scores, cesuurs):
+    """Computes the pass percentage, mean mark and mark histogram for every cesuur (in percent) at once."""
+
+    import numpy as np
+
+    cesuurs = np.asarray(cesuurs, dtype=float)
+    marks = mark_array(scores.scores[np.newaxis, :], cesuurs[:, np.newaxis] / 100.0, scores.totals[np.newaxis, :])
+    rounded = np.rint(marks).astype(int) - 1 + 10 * np.arange(len(cesuurs))[:, np.newaxis]
+    return CesuurSweep(
+        cesuurs,
+        100.0 * np.count_nonzero(marks >= 5.5, axis=1) / marks.shape[1],
+        marks.mean(axis=1),
+        np.bincount(rounded.ravel(), minlength=10 * len(cesuurs)).reshape(len(cesuurs), 10)
+    )
+
+
+ScoreMatrix = namedtuple("ScoreMatrix", ["referenties", "names", "max_scores", "scores"])
+
+
+@dispatch
+def score_matrix(cursor):
+    """Loads the checked answers as a students × questions NumPy array of scores.
+
+    Questions are in the order of the export; a missing answer scores 0. Marks with a
+    decimal comma, like 0,5, are read as numbers.
+    """
+
+    import numpy as np
+
+    questions = cursor.execute("SELECT QuestionId, Naam, Totaalscore FROM Question ORDER BY rowid").fetchall()
+    question_ids, names, max_scores = map(list, zip(*questions)) if questions else ([], [], [])
+    rows = cursor.execute("""
+        SELECT Referentie, QuestionId, CAST(REPLACE(DaadwerkelijkeMarkering, ',', '.') AS REAL)
+        FROM Answer
+        WHERE Nagekeken = 'Ja'
+    """).fetchall()
+    referenties, answer_question_ids, markings = zip(*rows) if rows else ((), (), ())
+    referenties, student_index = np.unique(np.array(referenties, dtype=np.int64), return_inverse=True)
+    question_index = {question_id: index for index, question_id in enumerate(question_ids)}
+    scores = np.zeros((len(referenties), len(question_ids)))
+    scores[student_index, [question_index[question_id] for question_id in answer_question_ids]] = np.array(
+        markings, dtype=float)
+    return ScoreMatrix(referenties, names, np.array(max_scores, dtype=float), scores)
 
 
-def pass_percentage(cursor, cesuur):
-    pass_count = 0
-    count = 0
-    for _, _, _, _, cijfer in student_score(cursor, cesuur):
-        if float(cijfer) >= 5.5:
-            pass_count += 1
-        count += 1
-    return 100.0 * pass_count / count
+ItemAnalysis = namedtuple("ItemAnalysis", ["names", "max_scores", "p_values", "rit", "rir", "alpha_if_deleted",
+                                           "alpha", "students"])
+
+
+def item_analysis(matrix):
+    """Computes the classical test theory statistics of every item from a score matrix at once.
+
+    The p-value is the mean score as a fraction of the maximum score, RIT and RIR correlate the
+    item with the total and the rest score (total minus the item) and alpha_if_deleted is
+    Cronbach's alpha of the test without the item. Undefined statistics are NaN.
+    """
+
+    import warnings
+
+    import numpy as np
+
+    scores = matrix.scores
+    students, items = scores.shape
+    totals = scores.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # var and mean of fewer than two students
+        item_variances = scores.var(axis=0, ddof=1)
+        total_variance = totals.var(ddof=1)
+        covariances = (scores - scores.mean(axis=0)).T @ (totals - totals.mean()) / (students - 1)
+        rest_variances = total_variance + item_variances - 2 * covariances
+        return ItemAnalysis(
+            matrix.names,
+            matrix.max_scores,
+            scores.mean(axis=0) / matrix.max_scores,
+            covariances / np.sqrt(item_variances * total_variance),
+            (covariances - item_variances) / np.sqrt(item_variances * rest_variances),
+            np.divide(items - 1, items - 2) * (1 - (item_variances.sum() - item_variances) / rest_variances)
+            if items > 2 else np.full(items, np.nan),
+            np.divide(items, items - 1) * (1 - item_variances.sum() / total_variance) if items > 1 else np.nan,
+            students
+        )
+
+
+TimeMatrix = namedtuple("TimeMatrix", ["names", "max_scores", "scores", "times", "positions"])
+
+
+@dispatch
+def time_matrix(cursor):
+    """Loads the score, Weergavetijd and Volgorde of the checked answers as students × questions arrays.
+
+    Questions are in the order of the export; a missing answer or time is NaN. Marks with a
+    decimal comma are read as numbers, like in score_matrix.
+    """
+
+    import numpy as np
+
+    questions = cursor.execute("SELECT QuestionId, Naam, Totaalscore FROM Question ORDER BY rowid").fetchall()
+    question_ids, names, max_scores = map(list, zip(*questions)) if questions else ([], [], [])
+    rows = cursor.execute("""
+        SELECT Referentie, QuestionId, CAST(REPLACE(DaadwerkelijkeMarkering, ',', '.') AS REAL),
+               Weergavetijd, Volgorde
+        FROM Answer
+        WHERE Nagekeken = 'Ja'
+    """).fetchall()
+    referenties, answer_question_ids, *values = zip(*rows) if rows else ((), (), (), (), ())
+    _, student_index = np.unique(np.array(referenties, dtype=np.int64), return_inverse=True)
+    question_index = {question_id: index for index, question_id in enumerate(question_ids)}
+    question_index = [question_index[question_id] for question_id in answer_question_ids]
+    matrices = []
+    for column in values:
+        try:
+            column = np.array(column, dtype=float)
+        except ValueError:
+            column = [value if isinstance(value, (int, float)) else np.nan for value in column]
+        matrix = np.full((student_index.max(initial=-1) + 1, len(question_ids)), np.nan)
+        matrix[student_index, question_index] = column
+        matrices.append(matrix)
+    return TimeMatrix(names, np.array(max_scores, dtype=float), *matrices)
+
+
+TimingAnalysis = namedtuple("TimingAnalysis", ["names", "medians", "p90s", "correlations", "long", "positions",
+                                               "position_answers", "position_times", "position_scores",
+                                               "position_score_correlation", "position_time_correlation"])
+
+
+def correlations(x, y):
+    """Returns the Pearson correlation of every column of x and y over the rows where both are not NaN."""
+
+    import numpy as np
+
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    answers = valid.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dx = np.where(valid, x - np.where(valid, x, 0).sum(axis=0) / answers, 0)
+        dy = np.where(valid, y - np.where(valid, y, 0).sum(axis=0) / answers, 0)
+        return (dx * dy).sum(axis=0) / np.sqrt((dx * dx).sum(axis=0) * (dy * dy).sum(axis=0))
+
+
+def timing_analysis(matrix):
+    """Computes the response time statistics of every question and presented position at once.
+
+    Per question the median and 90th percentile of the time and its correlation with the score;
+    a question is flagged as long when its median time lies above the third quartile plus 1.5
+    times the interquartile range of the medians of all questions. Per presented position the
+    number of answers, the mean time and the mean score as a percentage of the maximum score,
+    and over all answers the correlation of the position with the score and the time.
+    """
+
+    import warnings
+
+    import numpy as np
+
+    answered = ~np.isnan(matrix.times) & ~np.isnan(matrix.scores)
+    times = np.where(answered, matrix.times, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        medians = np.nanmedian(times, axis=0)
+        p90s = np.nanpercentile(times, 90, axis=0)
+        first_quartile = np.nanpercentile(medians, 25)
+        third_quartile = np.nanpercentile(medians, 75)
+    long = medians > third_quartile + 1.5 * (third_quartile - first_quartile)
+
+    positioned = answered & ~np.isnan(matrix.positions)
+    positions = matrix.positions[positioned].astype(int)
+    position_times = times[positioned]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        position_scores = 100.0 * (matrix.scores / matrix.max_scores)[positioned]
+    counts = np.bincount(positions, minlength=1)
+    present = np.flatnonzero(counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return TimingAnalysis(
+            matrix.names,
+            medians,
+            p90s,
+            correlations(times, matrix.scores),
+            long,
+            present,
+            counts[present],
+            np.bincount(positions, position_times, len(counts))[present] / counts[present],
+            np.bincount(positions, position_scores, len(counts))[present] / counts[present],
+            correlations(positions[:, np.newaxis].astype(float), position_scores[:, np.newaxis])[0],
+            correlations(positions[:, np.newaxis].astype(float), position_times[:, np.newaxis])[0]
+        )
 
 
 def students(cursor):
@@ -220,27 +690,91 @@ def students(cursor):
         NATURAL JOIN Answer
         WHERE Nagekeken = 'Ja'
         GROUP BY Referentie
-        ORDER BY Voornaam, Achternaam
+        ORDER BY Voornaam, Achternaam, Referentie
     """)
 
 
+def student_unit_results(cursor):
+    """Unit results of all students at once, ordered like students()."""
+    return cursor.execute("""
+        SELECT Referentie, Unit, COUNT(DISTINCT QuestionId) AS aantal, 100.0 * SUM(DaadwerkelijkeMarkering) / SUM(Question.Totaalscore) AS percentage
+        FROM Question
+        JOIN Answer USING (QuestionId)
+        JOIN Student USING (Referentie)
+        WHERE Nagekeken = 'Ja'
+        GROUP BY Referentie, Unit
+        ORDER BY Voornaam, Achternaam, Referentie, percentage DESC, Unit DESC
+    """)
+
+
+def student_learning_goals(cursor):
+    """Learning goal results of all students at once, ordered like students()."""
+    return cursor.execute("""
+        SELECT Referentie, LO, COUNT(DISTINCT QuestionId) AS aantal, 100.0 * SUM(DaadwerkelijkeMarkering) / SUM(Question.Totaalscore) AS percentage
+        FROM Question
+        JOIN Answer USING (QuestionId)
+        JOIN Student USING (Referentie)
+        WHERE Nagekeken = 'Ja' AND LO IS NOT NULL
+        GROUP BY Referentie, LO
+        ORDER BY Voornaam, Achternaam, Referentie, percentage DESC, LO DESC
+    """)
+
+
+def student_answers(cursor):
+    """Answers of all students at once, ordered like students()."""
+    return cursor.execute("""
+        SELECT Referentie, Naam, Reactie, Sleutel, DaadwerkelijkeMarkering, Question.TotaalScore
+        FROM Question
+        JOIN Answer USING (QuestionId)
+        JOIN Student USING (Referentie)
+        WHERE Nagekeken = 'Ja'
+        ORDER BY Voornaam, Achternaam, Referentie, Answer.rowid
+    """)
+
+
+def merge_students(students, *grouped):
+    """Yields every student together with its rows of each of the grouped result sets.
+
+    The grouped rows start with the Referentie and must be ordered like students.
+    """
+
+    groups = [groupby(rows, key=itemgetter(0)) for rows in grouped]
+    pending = [next(group, (None, ())) for group in groups]
+    for student in students:
+        referentie = student[-1]
+        rows = []
+        for index, group in enumerate(groups):
+            key, student_rows = pending[index]
+            if key == referentie:
+                rows.append([row[1:] for row in student_rows])
+                pending[index] = next(group, (None, ()))
+            else:
+                rows.append([])
+        yield student, rows
+
+
 def answers(cursor, referentie):
     return cursor.execute("""
         SELECT Naam, Reactie, Sleutel, DaadwerkelijkeMarkering, TotaalScore
         FROM Question
         NATURAL JOIN Answer
         WHERE Nagekeken = 'Ja' AND Referentie = ?
+        ORDER BY Answer.rowid
     """, (referentie,))
 
 
+MULTIPLECHOICE_ITEM_TYPES = "('Meerkeuzevraag', 'Meerdere antwoorden', 'Eender/of')"
+
+
 def multiplechoice_questions(cursor):
-    return cursor.execute("""
+    return cursor.execute(f"""
         SELECT QuestionId, Naam, Sleutel
         FROM Question
-        WHERE ItemType IN ('Meerkeuzevraag', 'Meerdere antwoorden', 'Eender/of')
+        WHERE ItemType IN {MULTIPLECHOICE_ITEM_TYPES}
     """)
 
 
+@dispatch
 def item_types(cursor):
     return cursor.execute("""
         SELECT ItemType, COUNT(DISTINCT QuestionId) AS aantal, 100.0 * SUM(DaadwerkelijkeMarkering) / SUM(TotaalScore) AS percentage
@@ -252,6 +786,7 @@ def item_types(cursor):
     """)
 
 
+@dispatch
 def units(cursor):
     return cursor.execute("""
         SELECT Unit
@@ -270,6 +805,7 @@ def unit_question(cursor, question_id):
     """, (question_id,))
 
 
+@dispatch
 def unit_distribution(db, unit):
     sql = """
         SELECT QuestionId, Naam
@@ -277,178 +813,278 @@ def unit_distribution(db, unit):
         WHERE Unit = ?
     """
     for question_id, name in db.cursor().execute(sql, (unit,)):
-        yield name, unit_question(db.cursor(), question_id)
+        yield name, unit_question(db.cursor(), question_id).fetchall()
 
 
+@dispatch
 def question_distribution(db):
     for question_id, name in db.cursor().execute("SELECT QuestionId, Naam FROM Question"):
-        yield name, unit_question(db.cursor(), question_id)
+        yield name, unit_question(db.cursor(), question_id).fetchall()
 
 
+@dispatch
 def unit_results(cursor, referentie=None):
     if referentie:
-        where = " AND Referentie = {}".format(referentie)
+        where, params = " AND Referentie = ?", (referentie,)
     else:
-        where = ""
+        where, params = "", ()
     return cursor.execute("""
         SELECT Unit, COUNT(DISTINCT QuestionId) AS aantal, 100.0 * SUM(DaadwerkelijkeMarkering) / SUM(Totaalscore) AS percentage
         FROM Question
         NATURAL JOIN Answer
         WHERE Nagekeken = 'Ja'{}
         GROUP BY Unit
-        ORDER BY percentage DESC
-    """.format(where)
-    )
+        ORDER BY percentage DESC, Unit DESC
+    """.format(where), params)
 
 
+@dispatch
 def learning_goals(cursor, referentie=None):
     if referentie:
-        where = " AND Referentie = {}".format(referentie)
+        where, params = " AND Referentie = ?", (referentie,)
     else:
-        where = ""
+        where, params = "", ()
     return cursor.execute("""
         SELECT LO, COUNT(DISTINCT QuestionId) AS aantal, 100.0 * SUM(DaadwerkelijkeMarkering) / SUM(Totaalscore) AS percentage
         FROM Question
         NATURAL JOIN Answer
         WHERE Nagekeken = 'Ja' AND LO IS NOT NULL{}
         GROUP BY LO
-        ORDER BY percentage DESC
-    """.format(where))
+        ORDER BY percentage DESC, LO DESC
+    """.format(where), params)
 
 
-@lru_cache(maxsize=1)
-def all_multiplechoice_answers(cursor):
-    cursor.execute("""
-        SELECT Reactie
+STUDENT_TOTALS = """
+    WITH Totals AS (
+        SELECT Referentie, SUM(DaadwerkelijkeMarkering) AS Total
+        FROM Answer
+        WHERE Nagekeken = 'Ja'
+        GROUP BY Referentie
+    )
+"""
+
+
+def multiplechoice_answer_counts(cursor):
+    """Returns per multiple choice question and response the number of answers.
+
+    For the checked answers it also returns their number and the sum of the total and
+    rest scores (total minus the score of the question) of the students who gave them.
+    """
+
+    return cursor.execute(STUDENT_TOTALS + f"""
+        SELECT QuestionId, Reactie, COUNT(*), COUNT(Total), SUM(Total), SUM(Total - DaadwerkelijkeMarkering)
         FROM Answer
-        NATURAL JOIN Question
-        WHERE ItemType IN ('Meerkeuzevraag', 'Meerdere antwoorden', 'Eender/of') AND Reactie != ''
-        GROUP BY Reactie
+        JOIN Question USING (QuestionId)
+        LEFT JOIN Totals ON Totals.Referentie = Answer.Referentie AND Answer.Nagekeken = 'Ja'
+        WHERE ItemType IN {MULTIPLECHOICE_ITEM_TYPES} AND Reactie != ''
+        GROUP BY QuestionId, Reactie
     """)
-    return sorted({choice for answer, in cursor for choice in answer.split('| ')})
 
 
-def distribution(cursor):
-    choices = all_multiplechoice_answers(cursor)
-    for question_id, name, correct_answer in multiplechoice_questions(cursor.connection.cursor()):
-        cursor.execute("""
-            SELECT Reactie, COUNT(*)
-            FROM Answer
-            WHERE QuestionId = ? AND Reactie != ''
-            GROUP BY Reactie
-        """, (question_id,))
-        result = {choice: 0 for choice in choices}
-        for answer, count in cursor:
-            for choice in answer.split('| '):
+def multiplechoice_rest_scores(cursor):
+    """Returns per multiple choice question the number, sum and sum of squares of the rest scores."""
+
+    return cursor.execute(STUDENT_TOTALS + f"""
+        SELECT QuestionId, COUNT(*), SUM(Total - DaadwerkelijkeMarkering),
+               SUM((Total - DaadwerkelijkeMarkering) * (Total - DaadwerkelijkeMarkering))
+        FROM Answer
+        JOIN Question USING (QuestionId)
+        JOIN Totals USING (Referentie)
+        WHERE ItemType IN {MULTIPLECHOICE_ITEM_TYPES} AND Nagekeken = 'Ja'
+        GROUP BY QuestionId
+    """)
+
+
+def split_counts(counts):
+    """Groups the rows of multiplechoice_answer_counts by question, splitting every distinct response only once."""
+
+    choices_of = {}
+    grouped = {}
+    for question_id, answer, *values in counts:
+        choices = choices_of.get(answer)
+        if choices is None:
+            choices = choices_of[answer] = answer.split('| ')
+        grouped.setdefault(question_id, []).append((choices, values))
+    return sorted({choice for choices in choices_of.values() for choice in choices}), grouped
+
+
+def distribution(cursor, counts=None):
+    """Returns the sorted choices and, per multiple choice question, its name, correct answer and choice counts.
+
+    A single grouped query supplies both the choices and the counts; every distinct
+    response is split into its choices only once.
+    """
+
+    all_choices, grouped = split_counts(multiplechoice_answer_counts(cursor) if counts is None else counts)
+    questions = []
+    for question_id, name, correct_answer in multiplechoice_questions(cursor):
+        result = {choice: 0 for choice in all_choices}
+        for choices, (count, *_) in grouped.get(question_id, []):
+            for choice in choices:
                 result[choice] += count
-        yield name, correct_answer, result
+        questions.append((name, correct_answer, result))
+    return all_choices, questions
+
+
+Distractor = namedtuple("Distractor", ["question", "choice", "correct", "count", "mean_total", "point_biserial"])
+
 
+def distractor_analysis(cursor, counts=None):
+    """Returns per chosen option of every multiple choice question the checked answers, the mean total
+    score of the students who chose it and the point-biserial correlation of choosing it with the rest score.
 
+    Everything follows from the grouped answer counts and the rest score moments per question, so the
+    number of queries does not depend on the number of questions or options.
+    """
+
+    _, grouped = split_counts(multiplechoice_answer_counts(cursor) if counts is None else counts)
+    rest_scores = {question_id: moments for question_id, *moments in multiplechoice_rest_scores(cursor)}
+    distractors = []
+    for question_id, name, correct_answer in multiplechoice_questions(cursor):
+        students, rest_sum, rest_squares = rest_scores.get(question_id, (0, 0, 0))
+        options = {}
+        for choices, (_, count, total_sum, choice_rest_sum) in grouped.get(question_id, []):
+            for choice in choices:
+                option = options.setdefault(choice, [0, 0, 0])
+                option[0] += count
+                option[1] += total_sum or 0
+                option[2] += choice_rest_sum or 0
+        variance = rest_squares / students - (rest_sum / students) ** 2 if students else 0
+        for choice, (count, total_sum, choice_rest_sum) in sorted(options.items()):
+            if count == 0:
+                continue
+            if 0 < count < students and variance > 0:
+                proportion = count / students
+                difference = choice_rest_sum / count - (rest_sum - choice_rest_sum) / (students - count)
+                point_biserial = difference / variance ** 0.5 * (proportion * (1 - proportion)) ** 0.5
+            else:
+                point_biserial = None
+            distractors.append(Distractor(name, choice, choice in correct_answer.split('| '), count,
+                                          total_sum / count, point_biserial))
+    return distractors
+
+
+@dispatch
 def get_toetsformulier(cursor):
     return cursor.execute("SELECT Toetsformulier, Toets, Totaalscore FROM Toets").fetchone()
 
 
-def plot_student_score(cursor, cesuur, plot_dir='.', plot_extension="png"):
-    cesuur /= 100.0
-    x = np.arange(1, 11)
-    y = np.zeros_like(x)
-    fig, axes = plt.subplots()
-    axes.set(title="Student score",
-             xlabel="cijfer",
-             ylabel="aantal",
-             xticks=x)
-    _, _, totaalscore = get_toetsformulier(cursor)
-    for _, _, daadwerkelijke_markering, _, cijfer in student_score(cursor, cesuur):
-        cijfer = round(cijfer)
-        y[cijfer - 1] += 1
-    axes.bar(x, y, align="center")
-    filename = os.path.join(plot_dir, f"student_score.{plot_extension}")
-    fig.savefig(filename)
-    plt.close()
-    return filename
-
-
-def plot_units(db, plot_dir=".", plot_extension="png"):
-    for unit, in units(db.cursor()):
-        yield plot_unit(list(unit_distribution(db, unit)), plot_dir, plot_extension, unit)
-
-
-def plot_questions(db, plot_dir=".", plot_extension="png"):
-    return plot_unit(list(question_distribution(db)), plot_dir, plot_extension, "questions")
-
-
-def plot_unit(distribution, plot_dir, plot_extension, unit):
-    fig, axes = plt.subplots(figsize=(6.4, 0.85 + len(distribution) / 2))
-    axes.set(title=unit,
-             xlabel="aantal studenten",
-             ylabel="vraag")
-    for name, marks in distribution:
-        left = 0
-        for mark, count in marks:
-            axes.barh(name, count, left=left, color=f"C{round(float(str(mark).replace(',', '.')))}")
-            if int(count) > 0:
-                axes.text(left + int(count) / 2, name, str(mark), verticalalignment="center")
-            left += count
-    make_axes_area_auto_adjustable(axes)
-    filename = os.path.join(plot_dir, f"unit_{unit}.{plot_extension}")
-    fig.savefig(filename)
-    plt.close()
-    return unit, filename
-
-
-def output_answer_score(cursor, output, plot_file=None):
-    print("Gemiddelde score per vraag", file=output)
-    print("==========================", file=output)
-    print(file=output)
-    if plot_file:
-        unit, file_name = plot_file
-        print(f"![{unit}]({file_name})", file=output)
-        print(file=output)
-    print("Vraag | MaxScore | Percentage", file=output)
-    print("----- | --------:| ----------:", file=output)
-    for question, max_score, percentage in answer_score(cursor):
-        print(f"{question} | {max_score:.0f} | {percentage:.1f}", file=output)
-    print(file=output)
+def mark_histogram(cursor, cesuur, scores=None):
+    """Returns the number of students per rounded mark 1 to 10."""
 
+    import numpy as np
 
-def format_answer(correct_answer, answer, count):
-    if count == 0:
-        return ""
-    elif answer in correct_answer:
-        return f"**{count:d}**"
-    else:
-        return str(count)
+    if scores is None:
+        scores = student_scores(cursor)
+    cijfers = np.rint(mark_array(scores.scores, cesuur / 100.0, scores.totals)).astype(int)
+    return np.bincount(cijfers - 1, minlength=10)
+
+
+def output_answer_score(cursor, writer, plot_file=None):
+    blocks = [Image(*plot_file)] if plot_file else []
+    blocks.append(Table(
+        [Column("Vraag"), Column("MaxScore", "right", format=".0f"), Column("Percentage", "right", format=".1f")],
+        list(answer_score(cursor))
+    ))
+    writer.write(Section("Gemiddelde score per vraag", blocks))
+
+
+def finite(values):
+    """Returns the values as floats, with None for NaN and infinity: an empty cell, or null in JSON."""
 
+    import numpy as np
 
-def output_distribution(cursor, output):
-    print("Antwoord distributie meerkeuzevragen", file=output)
-    print("====================================", file=output)
-    print(file=output)
-    print("Vraag | {}".format(" | ".join(all_multiplechoice_answers(cursor))), file=output)
-    print("----- | {}".format(" | ".join(map(lambda x: "-" * len(x), all_multiplechoice_answers(cursor)))), file=output)
-    for question, correct_answer, answers in distribution(cursor):
-        print("{} | {}".format(question, " | ".join(
-            [format_answer(correct_answer, answer, answers[answer]) for answer in answers])), file=output)
-    print(file=output)
+    return [float(value) if np.isfinite(value) else None for value in values]
 
 
-def output_student_score(cursor, output, cesuur):
-    print("Student scores", file=output)
-    print("==============", file=output)
-    print(file=output)
+def format_statistic(value):
+    import numpy as np
+
+    return f"{value:.2f}" if np.isfinite(value) else None
+
+
+def output_item_analysis(cursor, writer):
+    analysis = item_analysis(score_matrix(cursor))
+    writer.write(Section("Itemanalyse", [
+        Table([Column("", width=18), Column("", width=4)], [
+            ("Studenten", analysis.students),
+            ("Vragen", len(analysis.names)),
+            ("Cronbach's alpha", format_statistic(analysis.alpha))
+        ]),
+        Table(
+            [Column("Vraag"), Column("MaxScore", "right", format=".0f"), Column("P-waarde", "right", format=".2f"),
+             Column("RIT", "right", format=".2f"), Column("RIR", "right", format=".2f"),
+             Column("Alpha zonder item", "right", format=".2f")],
+            list(zip(analysis.names, analysis.max_scores, finite(analysis.p_values), finite(analysis.rit),
+                     finite(analysis.rir), finite(analysis.alpha_if_deleted)))
+        )
+    ]))
+
+
+def output_timing(cursor, writer):
+    analysis = timing_analysis(time_matrix(cursor))
+    writer.write(Section("Responstijden", [
+        Table([Column("", width=25), Column("", width=5)], [
+            ("Correlatie volgorde-score", format_statistic(analysis.position_score_correlation)),
+            ("Correlatie volgorde-tijd", format_statistic(analysis.position_time_correlation))
+        ]),
+        Table(
+            [Column("Vraag"), Column("Mediaan (s)", "right", format=".0f"), Column("P90 (s)", "right", format=".0f"),
+             Column("Rtijd-score", "right", format=".2f"), Column("Let op")],
+            [(name, median, p90, correlation, "x" if long else None) for name, median, p90, correlation, long
+             in zip(analysis.names, finite(analysis.medians), finite(analysis.p90s), finite(analysis.correlations),
+                    analysis.long)]
+        ),
+        Table(
+            [Column("Positie", "right", format="d"), Column("Aantal", "right", format="d"),
+             Column("Gemiddelde tijd (s)", "right", format=".1f"),
+             Column("Gemiddelde score (%)", "right", format=".1f")],
+            list(zip(analysis.positions, analysis.position_answers, finite(analysis.position_times),
+                     finite(analysis.position_scores)))
+        )
+    ]))
+
+
+def format_answer(correct_answer, answer, count):
+    if count == 0:
+        return None
+    elif answer in correct_answer:
+        return Strong(count)
+    else:
+        return count
+
+
+def output_distribution(cursor, writer):
+    counts = multiplechoice_answer_counts(cursor).fetchall()
+    choices, questions = distribution(cursor, counts)
+    rows = [[question] + [format_answer(correct_answer, answer, answers[answer]) for answer in answers]
+            for question, correct_answer, answers in questions]
+    columns = [Column("Vraag")] + [Column(choice, format="d") for choice in choices]
+    distractor_rows = [
+        (distractor.question, Strong(distractor.choice) if distractor.correct else distractor.choice,
+         distractor.count, distractor.mean_total, distractor.point_biserial,
+         "x" if not distractor.correct and (distractor.point_biserial or 0) > 0 else None)
+        for distractor in distractor_analysis(cursor, counts)
+    ]
+    writer.write(Section("Antwoord distributie meerkeuzevragen", [
+        Table(columns, rows),
+        Table([Column("Vraag"), Column("Optie"), Column("Aantal", "right", format="d"),
+               Column("Gemiddelde score", "right", format=".1f"), Column("Rpbis", "right", format=".2f"),
+               Column("Let op")], distractor_rows)
+    ]))
+
+
+def output_student_score(cursor, writer, cesuur, scores=None):
+    if scores is None:
+        scores = student_scores(cursor)
+    columns = [Column("Voornaam"), Column("Achternaam"), Column("Behaalde punten", "right"),
+               Column("Percentage", "right", format=".1f")]
     if cesuur:
-        toetsformulier, toets, totaalscore = get_toetsformulier(cursor)
-        cesuur /= 100.0
-        print("Voornaam | Achternaam | Behaalde punten | Percentage | Cijfer", file=output)
-        print("-------- | ---------- | ---------------:| ----------:| ------:", file=output)
-        for voornaam, achternaam, daadwerkelijke_markering, percentage, cijfer in student_score(cursor, cesuur):
-            print(f"{voornaam} | {achternaam} | {daadwerkelijke_markering} | {percentage:.1f} | {cijfer:.0f}", file=output)
+        columns.append(Column("Cijfer", "right", format=".0f"))
+        rows = list(student_score(cursor, cesuur / 100.0, scores))
     else:
-        print("Voornaam | Achternaam | Behaalde punten | Percentage", file=output)
-        print("-------- | ---------- | ---------------:| ----------:", file=output)
-        for voornaam, achternaam, daadwerkelijke_markering, percentage in student_score(cursor):
-            print(f"{voornaam} | {achternaam} | {daadwerkelijke_markering} | {percentage:.1f}", file=output)
-    print(file=output)
+        rows = list(student_score(cursor, scores=scores))
+    writer.write(Section("Student scores", [Table(columns, rows)]))
 
 
 def mark(actualscore, cesuur, totalscore):
@@ -473,117 +1109,178 @@ def score(daadwerkelijke_markering, cesuur, totalscore):
         return totalscore - (10.0 - daadwerkelijke_markering) * (1.0 - cesuur) * totalscore / 4.5
 
 
-def output_student_detail(cursor, output, show_units=True, show_learning_goals=True):
-    print("Gemaakte toetsen", file=output)
-    print("================", file=output)
-    print(file=output)
-    for voornaam, achternaam, referentie in list(students(cursor)):
-        name = " ".join([voornaam, achternaam])
-        print(name, file=output)
-        print("-" * len(name), file=output)
-        print(file=output)
+def mark_array(actualscores, cesuur, totalscore):
+    """Vectorized mark(): returns the marks of an array of scores."""
+
+    import numpy as np
+
+    actualscores = np.asarray(actualscores, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        marks = np.where(actualscores < cesuur * totalscore,
+                         1.0 + 4.5 * actualscores / (cesuur * totalscore),
+                         10.0 - 4.5 * (totalscore - actualscores) / ((1.0 - cesuur) * totalscore))
+    marks = np.where(actualscores > totalscore, 10.0, marks)
+    return np.where(actualscores < 0, 1.0, marks)
+
+
+def score_array(marks, cesuur, totalscore):
+    """Vectorized score(): returns the scores of an array of marks."""
+
+    import numpy as np
+
+    marks = np.asarray(marks, dtype=float)
+    scores = np.where(marks < 5.5,
+                      (marks - 1.0) * cesuur * totalscore / 4.5,
+                      totalscore - (10.0 - marks) * (1.0 - cesuur) * totalscore / 4.5)
+    scores = np.where(marks > 10.0, totalscore, scores)
+    return np.where(marks < 1.0, 0.0, scores)
+
+
+def output_student_detail(cursor, writer, show_units=True, show_learning_goals=True):
+    db = cursor.connection
+    grouped = [
+        student_unit_results(db.cursor()) if show_units else [],
+        student_learning_goals(db.cursor()) if show_learning_goals else [],
+        student_answers(db.cursor())
+    ]
+    blocks = []
+    for (voornaam, achternaam, referentie), (unit_rows, learning_goal_rows, answer_rows) in merge_students(
+            students(cursor), *grouped):
+        blocks.append(Heading(" ".join([voornaam, achternaam])))
         if show_units:
-            print("Unit                            | Aantal | Percentage", file=output)
-            print("------------------------------- | ------:| ----------:", file=output)
-            for unit, count, percentage in unit_results(cursor, referentie):
-                if unit:
-                    print(f"{unit} | {count:.0f} | {percentage:.1f}", file=output)
-            print(file=output)
+            blocks.append(Table(
+                [Column("Unit", width=31), Column("Aantal", "right", format=".0f"),
+                 Column("Percentage", "right", format=".1f")],
+                [row for row in unit_rows if row[0]]
+            ))
         if show_learning_goals:
-            print("Leerdoel                                                  | Aantal | Percentage", file=output)
-            print("--------------------------------------------------------- | ------:| -----------:", file=output)
-            for lo, count, percentage in learning_goals(cursor, referentie):
-                if lo:
-                    print("{} | {:.0f} | {:.1f}".format(lo.replace("|", "/"), count, percentage), file=output)
-            print(file=output)
-        print("Vraag                 | Gegeven antwoord (Goede antwoord)                     | Behaalde score / Max score", file=output)
-        print("--------------------- | ----------------------------------------------------- | --------------------------:", file=output)
-        for Naam, Reactie, Sleutel, DaadwerkelijkeMarkering, TotaalScore in answers(cursor, referentie):
-            print("{} | {} ({}) | {} / {}".format(
-                Naam,
-                Reactie.replace("|", "/"),
-                Sleutel.replace("|", "/"),
-                DaadwerkelijkeMarkering,
-                TotaalScore
-            ), file=output)
-    print(file=output)
-
-
-def output_item_types(cursor, output):
-    print("Item types", file=output)
-    print("==========", file=output)
-    print(file=output)
-    print("ScoreType | Aantal | Percentage", file=output)
-    print("--------- | ------:| ----------:", file=output)
-    for itemtype, count, percentage in item_types(cursor):
-        print(f"{itemtype} | {count:.0f} | {percentage:.1f}", file=output)
-    print(file=output)
-
-
-def output_units(cursor, output, plot_files=None):
-    print("Units", file=output)
-    print("=====", file=output)
-    print(file=output)
-    if plot_files:
-        for unit, plot_file in plot_files:
-            print(f"![{unit}]({plot_file})", file=output)
-            print(file=output)
-    print("Unit                                | Aantal | Percentage", file=output)
-    print("----------------------------------- | ------:| ----------:", file=output)
-    for unit, count, percentage in unit_results(cursor):
-        if unit:
-            print(f"{unit} | {count:.0f} | {percentage:.1f}", file=output)
-    print(file=output)
-
-
-def output_learning_goals(cursor, output):
-    print("Leerdoelen", file=output)
-    print("==========", file=output)
-    print(file=output)
-    print("Leerdoel                                                  | Aantal | Percentage", file=output)
-    print("--------------------------------------------------------- | ------:| ----------:", file=output)
-    for lo, count, percentage in learning_goals(cursor):
-        if lo:
-            print("{} | {:.0f} | {:.1f}".format(lo.replace("|", "/"), count, percentage), file=output)
-    print(file=output)
-
-
-def output_toets(cursor, output, cesuur, plot_file=None):
+            blocks.append(Table(
+                [Column("Leerdoel", width=57), Column("Aantal", "right", format=".0f"),
+                 Column("Percentage", "right", 11, ".1f")],
+                [row for row in learning_goal_rows if row[0]]
+            ))
+        blocks.append(Table(
+            [Column("Vraag", width=21), Column("Gegeven antwoord (Goede antwoord)", width=53),
+             Column("Behaalde score / Max score", "right")],
+            [(naam, f"{reactie} ({sleutel})", f"{daadwerkelijke_markering} / {totaalscore}")
+             for naam, reactie, sleutel, daadwerkelijke_markering, totaalscore in answer_rows]
+        ))
+    writer.write(Section("Gemaakte toetsen", blocks))
+
+
+def output_item_types(cursor, writer):
+    writer.write(Section("Item types", [Table(
+        [Column("ScoreType"), Column("Aantal", "right", format=".0f"), Column("Percentage", "right", format=".1f")],
+        list(item_types(cursor))
+    )]))
+
+
+def output_units(cursor, writer, plot_files=None):
+    blocks = [Image(unit, plot_file) for unit, plot_file in plot_files or []]
+    blocks.append(Table(
+        [Column("Unit", width=35), Column("Aantal", "right", format=".0f"),
+         Column("Percentage", "right", format=".1f")],
+        [row for row in unit_results(cursor) if row[0]]
+    ))
+    writer.write(Section("Units", blocks))
+
+
+def output_learning_goals(cursor, writer):
+    writer.write(Section("Leerdoelen", [Table(
+        [Column("Leerdoel", width=57), Column("Aantal", "right", format=".0f"),
+         Column("Percentage", "right", format=".1f")],
+        [row for row in learning_goals(cursor) if row[0]]
+    )]))
+
+
+def output_toets(cursor, writer, cesuur, plot_file=None, scores=None):
     toetsformulier, toets, total_mark = get_toetsformulier(cursor)
-    print(toetsformulier, file=output)
-    print("=" * len(toetsformulier), file=output)
-    print(file=output)
-    print("------------------   ----", file=output)
-    print("Toets                ", toets, file=output)
-    print("Max score           ", total_mark, file=output)
+    rows = [("Toets", toets), ("Max score", total_mark)]
     if cesuur:
-        print(f"Cesuur               {cesuur:.1f}%", file=output)
-        print("Voldoende            {:.1f} punten".format(total_mark * cesuur / 100), file=output)
-        print("Gokkans              {:.1f}%".format(2 * cesuur - 100), file=output)
-        print("Slagingspercentage   {:.1f}%".format(pass_percentage(cursor, cesuur / 100.0)), file=output)
-    print("------------------   ----", file=output)
+        if scores is None:
+            scores = student_scores(cursor)
+        rows += [
+            ("Cesuur", f"{cesuur:.1f}%"),
+            ("Voldoende", "{:.1f} punten".format(total_mark * cesuur / 100)),
+            ("Gokkans", "{:.1f}%".format(2 * cesuur - 100)),
+            ("Slagingspercentage", "{:.1f}%".format(pass_percentage(scores, cesuur / 100.0)))
+        ]
+    blocks = [Table([Column("", width=18), Column("", width=4)], rows)]
     if plot_file:
-        print(file=output)
-        print(f"![Student score]({plot_file})", file=output)
+        blocks.append(Image("Student score", plot_file))
+    writer.write(Section(toetsformulier, blocks))
+
+
+def output_translation(cursor, writer, cesuur):
+    import numpy as np
 
-    print(file=output)
+    _, _, total_mark = get_toetsformulier(cursor)
+    bounds = score_array(np.arange(0.5, 11.0), cesuur / 100.0, total_mark)
+    rows = [("{:.1f} - {:.1f}".format(bounds[cijfer - 1], bounds[cijfer]), cijfer) for cijfer in range(1, 11)]
+    writer.write(Section("Omrekeningstabel", [Table([Column("Score       ", width=11), Column("Cijfer")], rows)]))
 
 
-def output_translation(cursor, output, cesuur):
+def output_cesuur_sweep(cursor, writer, cesuurs, scores=None, plot_file=None):
     _, _, total_mark = get_toetsformulier(cursor)
-    cesuur /= 100.0
-    print("Omrekeningstabel", file=output)
-    print("================", file=output)
-    print(file=output)
-    print("Score        | Cijfer", file=output)
-    print("-----------  | ------", file=output)
-    for cijfer in range(1, 11):
-        print("{:.1f} - {:.1f} | {:d}".format(
-            score(cijfer - 0.5, cesuur, total_mark),
-            score(cijfer + 0.5, cesuur, total_mark),
-            cijfer
-        ), file=output)
-    print(file=output)
+    if scores is None:
+        scores = student_scores(cursor)
+    sweep = cesuur_sweep(scores, cesuurs)
+    blocks = [Image("Cesuur analyse", plot_file)] if plot_file else []
+    columns = [Column("Cesuur", "right", format=".1f"), Column("Voldoende", "right", format=".1f"),
+               Column("Slagingspercentage", "right", format=".1f"), Column("Gemiddeld cijfer", "right", format=".1f")]
+    columns += [Column(str(cijfer), "right") for cijfer in range(1, 11)]
+    rows = [[cesuur, total_mark * cesuur / 100, percentage, mean_mark] + list(histogram)
+            for cesuur, percentage, mean_mark, histogram in zip(*sweep)]
+    blocks.append(Table(columns, rows))
+    writer.write(Section("Cesuur analyse", blocks))
+    return sweep
+
+
+def cesuur_range(value):
+    """Parses start:stop:step into the list of cesuurs from start up to and including stop."""
+
+    try:
+        start, stop, step = map(float, value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected start:stop:step, got {value!r}")
+    if step <= 0 or stop < start:
+        raise argparse.ArgumentTypeError(f"empty cesuur range {value!r}")
+    if start <= 0 or stop >= 100:
+        raise argparse.ArgumentTypeError(f"cesuurs must lie between 0 and 100, got {value!r}")
+    return [start + index * step for index in range(int(round((stop - start) / step, 9)) + 1)]
+
+
+SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d*)?(?:[eE][-+]?\d+)?\b")
+
+
+def normalize_statement(statement):
+    """Replaces the literals in statement by ? and collapses its whitespace.
+
+    The trace callback gets the statements with their parameters filled in, so this
+    makes the executions of one query with different parameters equal again.
+    """
+
+    return " ".join(SQL_LITERAL.sub("?", statement).split())
+
+
+def explain(db, statements, output):
+    """Prints the EXPLAIN QUERY PLAN of every distinct SELECT statement, also with a WITH clause, in statements.
+
+    Statements that only differ in their parameters are explained once, with the parameters of the first.
+    """
+
+    distinct = {}
+    for statement in statements:
+        distinct.setdefault(normalize_statement(statement), statement)
+    for statement in distinct.values():
+        if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            continue
+        print(textwrap.dedent(statement).strip(), file=output)
+        depths = {0: 0}
+        for node_id, parent, _, detail in db.execute("EXPLAIN QUERY PLAN " + statement):
+            depths[node_id] = depths.get(parent, 0) + 1
+            print("{}{}".format("  " * depths[node_id], detail), file=output)
+        print(file=output)
 
 
 def get_argument_parser():
@@ -591,7 +1288,7 @@ def get_argument_parser():
         Parser for ItemsDeliveredRawReport.csv file produced by Surpass.
 
         A markdown file is outputed with the sections you indicate with
-        the optional arguments.
+        the optional arguments. Use --format for HTML, CSV or JSON instead.
 
         Tip: if you want to produce a pdf use:
         ./surparser.py --all | pandoc -o surparser.pdf -f markdown
@@ -605,26 +1302,87 @@ def get_argument_parser():
                                 dest="answer_score",
                                 help="Lists all questions ordered by the average score"
                                 )
+    argumentParser.add_argument("--append",
+                                action="store_true",
+                                help="Add the input to the database given by --db instead of replacing its contents; "
+                                     "inputs that were added before are skipped"
+                                )
+    argumentParser.add_argument("--bulk-load",
+                                action="store_true",
+                                dest="bulk_load",
+                                help="Load the input in a single transaction and report the duration of each phase"
+                                )
+    argumentParser.add_argument("--cache-dir",
+                                dest="cache_dir",
+                                help="Directory where parsed exports are cached, keyed by the md5 of the input",
+                                metavar="directory"
+                                )
+    argumentParser.add_argument("--cache-size",
+                                default=512,
+                                dest="cache_size",
+                                help="Maximum size of the cache directory in MB (defaults to 512)",
+                                metavar="MB",
+                                type=float
+                                )
     argumentParser.add_argument("--cesuur",
                                 help="Cesuur",
                                 metavar="percentage",
                                 type=float
                                 )
+    argumentParser.add_argument("--cesuur-sweep",
+                                dest="cesuur_sweep",
+                                help="Adds the pass percentage and mark distribution for a range of cesuurs",
+                                metavar="start:stop:step",
+                                type=cesuur_range
+                                )
+    argumentParser.add_argument("--cprofile",
+                                help="Profile the run with cProfile and store the statistics for python -m pstats",
+                                metavar="stats.prof"
+                                )
     argumentParser.add_argument("--db",
                                 default=":memory:",
                                 help="Name of the database file (defaults to :memory:)",
-                                metavar="database.db",
-                                type=open_database
+                                metavar="database.db"
                                 )
     argumentParser.add_argument("--distribution",
                                 action="store_true",
                                 help="Adds a table of multiple choice answers and their distribution"
                                 )
+    argumentParser.add_argument("--engine",
+                                choices=["numpy", "sqlite"],
+                                default="sqlite",
+                                help="Keep the input in SQLite or in NumPy arrays, which is faster for large exams "
+                                     "but does not support --distribution and --student-detail (defaults to sqlite)"
+                                )
+    argumentParser.add_argument("--explain",
+                                action="store_true",
+                                help="Print the query plan of every report query to stderr"
+                                )
+    argumentParser.add_argument("--export",
+                                help="Directory where the Toets, Student, Question and Answer tables are exported",
+                                metavar="directory"
+                                )
+    argumentParser.add_argument("--export-format",
+                                choices=EXPORT_FORMATS,
+                                default="ndjson",
+                                dest="export_format",
+                                help="Format of the exported tables (defaults to ndjson; parquet requires pyarrow)"
+                                )
+    argumentParser.add_argument("--format",
+                                choices=sorted(WRITERS),
+                                default="markdown",
+                                help="Format of the output (defaults to markdown)"
+                                )
     argumentParser.add_argument("--input",
                                 default="ItemsDeliveredRawReport.csv",
                                 help="Name of the input CSV file (defaults to ItemsDeliveredRawReport.csv)",
                                 metavar="input_file_name.csv"
                                 )
+    argumentParser.add_argument("--item-analysis",
+                                action="store_true",
+                                dest="item_analysis",
+                                help="Adds p-values, item-total (RIT) and item-rest (RIR) correlations and Cronbach's alpha"
+                                )
     argumentParser.add_argument("--item-type",
                                 action="store_true",
                                 dest="item_type",
@@ -651,12 +1409,28 @@ def get_argument_parser():
                                 help="Directory where plots are stored (defaults to .)",
                                 metavar="directory"
                                 )
+    argumentParser.add_argument("--plot-jobs",
+                                dest="plot_jobs",
+                                help="Number of processes rendering plots (defaults to the number of CPUs)",
+                                metavar="N",
+                                type=int
+                                )
     argumentParser.add_argument("--plot-extension",
                                 default="png",
                                 dest="plot_extension",
                                 help="Extension of the plots (defaults to png",
                                 metavar="png/jpeg/pdf/..."
                                 )
+    argumentParser.add_argument("--profile",
+                                action="store_true",
+                                help="Print the duration, SQL queries and rows of every phase to stderr"
+                                )
+    argumentParser.add_argument("--profile-json",
+                                dest="profile_json",
+                                help="Write the duration, SQL queries and rows of every phase as JSON",
+                                metavar="trace.json",
+                                type=argparse.FileType("w")
+                                )
     argumentParser.add_argument("--student-detail",
                                 action="store_true",
                                 dest="student_detail",
@@ -672,6 +1446,11 @@ def get_argument_parser():
                                 dest="test_title",
                                 help="Lists the title of the test form"
                                 )
+    argumentParser.add_argument("--timing",
+                                action="store_true",
+                                help="Adds the median and 90th percentile time per question, its correlation with "
+                                     "the score and the effect of the presented position"
+                                )
     argumentParser.add_argument("--translation",
                                 action="store_true",
                                 help="Add a translation table between score and marks"
@@ -680,46 +1459,163 @@ def get_argument_parser():
                                 action="store_true",
                                 help="Lists all units with their average score"
                                 )
+    argumentParser.set_defaults(input_md5=None)
     return argumentParser
 
 
-def run(arguments):
-    read_csv(arguments.input, arguments.db.cursor())
-    arguments.db.commit()
-    unit_plot_files = None
-    arguments.units = len(list(units(arguments.db.cursor()))) > 0 and (arguments.units or arguments.all)
-    arguments.learning_goals = len(list(learning_goals(arguments.db.cursor()))) > 0 and (
+def load_database(arguments):
+    def load(db, input_filename):
+        if arguments.bulk_load:
+            for phase, seconds in bulk_load(db, input_filename):
+                print(f"{phase:<8} {seconds:.3f} s", file=sys.stderr)
+        else:
+            read_csv(input_filename, db.cursor())
+            db.commit()
+
+    if arguments.engine == "numpy":
+        from engine import ArrayExam, unsupported_arguments
+
+        unsupported = unsupported_arguments(arguments)
+        if unsupported:
+            raise SystemExit("--engine numpy does not support " + ", ".join(unsupported) + "; use --engine sqlite")
+        db = ArrayExam.load(arguments.input)
+    elif arguments.append:
+        db = open_database(arguments.db, clear=False)
+        if not ingest(db, arguments.input, load, arguments.input_md5):
+            print(f"{arguments.input} was added before", file=sys.stderr)
+    elif arguments.cache_dir:
+        db, _ = cached_database(arguments.cache_dir, arguments.input, load, arguments.cache_size * 1024 * 1024,
+                                arguments.input_md5)
+    else:
+        db = open_database(arguments.db)
+        load(db, arguments.input)
+    return db
+
+
+def collect_plots(db, arguments, scores):
+    """Gathers the data of every plot run() needs, keyed by the section it belongs to."""
+
+    import plots
+
+    figures = {}
+    plot_arguments = (arguments.plot_dir, arguments.plot_extension)
+    if (arguments.test_title or arguments.all) and arguments.cesuur:
+        histogram = mark_histogram(db.cursor(), arguments.cesuur, scores)
+        figures["student_score"] = (plots.plot_marks, (histogram,) + plot_arguments)
+    if arguments.cesuur_sweep:
+        sweep = cesuur_sweep(scores, arguments.cesuur_sweep)
+        figures["cesuur_sweep"] = (plots.plot_cesuur_sweep, (sweep,) + plot_arguments)
+    if arguments.units:
+        for unit, in units(db.cursor()):
+            distribution = list(unit_distribution(db, unit))
+            figures["unit", unit] = (plots.plot_unit, (distribution,) + plot_arguments + (unit,))
+    elif arguments.answer_score or arguments.all:
+        distribution = list(question_distribution(db))
+        figures["questions"] = (plots.plot_unit, (distribution,) + plot_arguments + ("questions",))
+    return figures
+
+
+def run(arguments, profile=None):
+    """Writes the report, recording the phases in profile (a new Profile by default).
+
+    --profile and --profile-json output the profile; --cprofile also profiles the run with cProfile.
+    """
+
+    if profile is None:
+        profile = Profile()
+    if arguments.cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.runcall(write_report, arguments, profile)
+        profiler.dump_stats(arguments.cprofile)
+    else:
+        write_report(arguments, profile)
+    if arguments.profile:
+        profile.output_summary(sys.stderr)
+    if arguments.profile_json:
+        profile.dump(arguments.profile_json)
+        arguments.profile_json.close()
+    return profile
+
+
+def write_report(arguments, profile):
+    with profile.span("load"):
+        db = load_database(arguments)
+        profile.rows += db.total_changes
+    if arguments.export:
+        with profile.span("export"):
+            export_tables(db, arguments.export, arguments.export_format)
+    statements = []
+    if arguments.explain:
+        db.set_trace_callback(lambda statement: (profile.trace(statement), statements.append(statement)))
+    else:
+        db.set_trace_callback(profile.trace)
+    arguments.units = len(list(units(db.cursor()))) > 0 and (arguments.units or arguments.all)
+    arguments.learning_goals = len(list(learning_goals(db.cursor()))) > 0 and (
             arguments.learning_goals or arguments.all)
+    if arguments.cesuur or arguments.cesuur_sweep or arguments.student_score or arguments.all:
+        with profile.span("student_scores"):
+            scores = student_scores(db.cursor())
+    else:
+        scores = None
+    if arguments.plot:
+        import plots
+
+        with profile.span("collect_plots"):
+            figures = collect_plots(db, arguments, scores)
+        timings = {}
+        with profile.span("render_plots"):
+            plot_files = plots.render_plots(figures, arguments.plot_jobs, timings)
+        for key, seconds in timings.items():
+            profile.add(key if isinstance(key, str) else " ".join(key), seconds, "render_plots")
+    else:
+        plot_files = {}
+    writer = profile.writer(WRITERS[arguments.format](arguments.output))
     if arguments.test_title or arguments.all:
-        if arguments.plot and arguments.cesuur:
-            student_score_plot_file = plot_student_score(arguments.db.cursor(), arguments.cesuur, arguments.plot_dir,
-                                                         arguments.plot_extension)
-        else:
-            student_score_plot_file = None
-        output_toets(arguments.db.cursor(), arguments.output, arguments.cesuur, student_score_plot_file)
+        with profile.span("output_toets"):
+            output_toets(db.cursor(), writer, arguments.cesuur, plot_files.get("student_score"), scores)
     if (arguments.translation or arguments.all) and arguments.cesuur:
-        output_translation(arguments.db.cursor(), arguments.output, arguments.cesuur)
+        with profile.span("output_translation"):
+            output_translation(db.cursor(), writer, arguments.cesuur)
+    if arguments.cesuur_sweep:
+        with profile.span("output_cesuur_sweep"):
+            output_cesuur_sweep(db.cursor(), writer, arguments.cesuur_sweep, scores,
+                                plot_files.get("cesuur_sweep"))
     if arguments.student_score or arguments.all:
-        output_student_score(arguments.db.cursor(), arguments.output, arguments.cesuur)
+        with profile.span("output_student_score"):
+            output_student_score(db.cursor(), writer, arguments.cesuur, scores)
     if arguments.item_type or arguments.all:
-        output_item_types(arguments.db.cursor(), arguments.output)
+        with profile.span("output_item_types"):
+            output_item_types(db.cursor(), writer)
     if arguments.units:
-        if arguments.plot:
-            unit_plot_files = plot_units(arguments.db, arguments.plot_dir, arguments.plot_extension)
-        output_units(arguments.db.cursor(), arguments.output, unit_plot_files)
+        unit_plot_files = [plot_file for key, plot_file in plot_files.items() if key[0] == "unit"]
+        with profile.span("output_units"):
+            output_units(db.cursor(), writer, unit_plot_files)
     if arguments.learning_goals:
-        output_learning_goals(arguments.db.cursor(), arguments.output)
+        with profile.span("output_learning_goals"):
+            output_learning_goals(db.cursor(), writer)
     if arguments.answer_score or arguments.all:
-        if arguments.plot and not unit_plot_files:
-            question_plot_file = plot_questions(arguments.db, arguments.plot_dir, arguments.plot_extension)
-        else:
-            question_plot_file = None
-        output_answer_score(arguments.db.cursor(), arguments.output, question_plot_file)
+        with profile.span("output_answer_score"):
+            output_answer_score(db.cursor(), writer, plot_files.get("questions"))
+    if arguments.item_analysis or arguments.all:
+        with profile.span("output_item_analysis"):
+            output_item_analysis(db.cursor(), writer)
+    if arguments.timing or arguments.all:
+        with profile.span("output_timing"):
+            output_timing(db.cursor(), writer)
     if arguments.distribution or arguments.all:
-        output_distribution(arguments.db.cursor(), arguments.output)
+        with profile.span("output_distribution"):
+            output_distribution(db.cursor(), writer)
     if arguments.student_detail or arguments.all:
-        output_student_detail(arguments.db.cursor(), arguments.output, arguments.units, arguments.learning_goals)
-    arguments.output.close()
+        with profile.span("output_student_detail"):
+            output_student_detail(db.cursor(), writer, arguments.units, arguments.learning_goals)
+    db.set_trace_callback(None)
+    if arguments.explain:
+        explain(db, statements, sys.stderr)
+    db.close()
+    with profile.span("close"):
+        writer.close()
 
 
 if __name__ == "__main__":
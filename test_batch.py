@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import unittest
+
+from batch import *
+from benchmark import generate_export
+from test_surparser import write_export
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.exports = os.path.join(self.directory.name, "exports")
+        for exam in ["toets1", "toets2"]:
+            os.makedirs(os.path.join(self.exports, exam))
+            write_export(os.path.join(self.exports, exam, "ItemsDeliveredRawReport.csv"))
+        with open(os.path.join(self.exports, "broken.csv"), "w") as csvfile:
+            csvfile.write("not a surpass export\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_exam_names(self):
+        filenames = find_exports([self.exports])
+        self.assertEqual(["broken", "toets1", "toets2"], exam_names(filenames))
+
+    def test_failing_export_does_not_stop_the_batch(self):
+        output_dir = os.path.join(self.directory.name, "output")
+        results = run_batch(find_exports([self.exports]), output_dir, ["--all", "--cesuur", "55"], jobs=2)
+        self.assertEqual(["broken", "toets1", "toets2"], [name for name, _, _ in results])
+        self.assertIsNotNone(results[0][2])
+        self.assertEqual([None, None], [error for _, _, error in results[1:]])
+        with open(os.path.join(output_dir, "toets1", "toetsanalyse.md")) as output:
+            self.assertIn("Slagingspercentage   33.3%", output.read())
+
+    def test_exported_tables_are_written_per_exam(self):
+        arguments = exam_arguments("toets1.csv", os.path.join("output", "toets1"), ["--export", "tables", "--all"])
+        self.assertEqual(["--export", os.path.join("tables", "toets1"), "--all"], arguments[2:5])
+
+
+    def test_every_exam_gets_its_own_database(self):
+        generate_export(os.path.join(self.exports, "toets2", "ItemsDeliveredRawReport.csv"), students=60, questions=5)
+        output_dir = os.path.join(self.directory.name, "output")
+        results = run_batch(find_exports([os.path.join(self.exports, "toets*", "*.csv")]), output_dir,
+                            ["--student-score", "--db", os.path.join(self.directory.name, "shared.db")], jobs=2)
+        self.assertEqual([None, None], [error for _, _, error in results])
+        for exam, students in [("toets1", 3), ("toets2", 60)]:
+            with open(os.path.join(output_dir, exam, "toetsanalyse.md")) as output:
+                self.assertEqual(students + 2, sum(" | " in line for line in output))
+            self.assertTrue(os.path.exists(os.path.join(output_dir, exam, "shared.db")))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "shared.db")))
+
+
+if __name__ == '__main__':
+    unittest.main()
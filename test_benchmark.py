@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+import os
+import tempfile
+import unittest
+
+from benchmark import *
+
+
+class GenerateExportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.directory.name, "ItemsDeliveredRawReport.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_generated_export_can_be_read(self):
+        generate_export(self.input, students=40, questions=10, units=3, learning_goals=4, multiple_choice=0.6,
+                        invalid=0.25)
+        db = surparser.open_database(":memory:")
+        surparser.read_csv(self.input, db.cursor())
+        self.assertEqual(40, db.execute("SELECT COUNT(*) FROM Student").fetchone()[0])
+        self.assertEqual(6, db.execute("SELECT COUNT(*) FROM Question WHERE ItemType = 'Meerkeuzevraag'")
+                         .fetchone()[0])
+        self.assertEqual(3, db.execute("SELECT COUNT(DISTINCT Unit) FROM Question").fetchone()[0])
+        self.assertEqual(4, db.execute("SELECT COUNT(DISTINCT LO) FROM Question").fetchone()[0])
+        invalid = db.execute("SELECT COUNT(*) FROM Student WHERE Cijfer = 'Ongeldig'").fetchone()[0]
+        self.assertTrue(0 < invalid < 40)
+        self.assertEqual(10 * invalid, db.execute("SELECT COUNT(*) FROM Answer WHERE Nagekeken = 'Nee'")
+                         .fetchone()[0])
+
+    def test_time_phases(self):
+        generate_export(self.input, students=20, questions=5)
+        timings = time_phases(self.input)
+        self.assertEqual(["load", "student_scores", "output_toets", "output_translation", "output_student_score",
+                          "output_item_types", "output_units", "output_learning_goals", "output_answer_score",
+                          "output_item_analysis", "output_timing", "output_distribution", "output_student_detail",
+                          "close"], list(timings))
+
+    def test_size(self):
+        self.assertEqual((500, 100), size("500x100"))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            size("500")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+import os
+import unittest
+
+from benchmark import generate_export
+from engine import *
+from surparser import *
+from test_surparser import ExportTestCase, write_decimal_comma_mark
+
+SECTIONS = ["--test-title", "--translation", "--student-score", "--item-type", "--units", "--learning-goals",
+            "--answer-score", "--item-analysis", "--timing", "--cesuur-sweep", "40:70:10"]
+
+
+class ArrayExamTest(ExportTestCase):
+    def report(self, input_filename, engine, output_format="markdown"):
+        output = os.path.join(self.directory.name, f"{engine}.{output_format}")
+        run(get_argument_parser().parse_args(["--input", input_filename, "--output", output, "--cesuur", "55",
+                                              "--engine", engine, "--format", output_format] + SECTIONS))
+        with open(output) as report:
+            return report.read()
+
+    def test_report_is_identical_to_sqlite(self):
+        for output_format in ["markdown", "json"]:
+            self.assertEqual(self.report(self.input, "sqlite", output_format),
+                             self.report(self.input, "numpy", output_format))
+
+    def test_decimal_comma_report_is_identical_to_sqlite(self):
+        write_decimal_comma_mark(self.input)
+        self.assertEqual(self.report(self.input, "sqlite"), self.report(self.input, "numpy"))
+        self.assertEqual([1, 1.5, 1], ArrayExam.load(self.input).score_matrix().scores[0].tolist())
+
+    def test_synthetic_report_is_identical_to_sqlite(self):
+        filename = os.path.join(self.directory.name, "synthetic.csv")
+        generate_export(filename, students=60, questions=25, seed=3, invalid=0.1)
+        self.assertEqual(self.report(filename, "sqlite"), self.report(filename, "numpy"))
+
+    def test_queries_match_sqlite(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        exam = ArrayExam.load(self.input)
+        for query in [answer_score, item_types, units, unit_results, learning_goals]:
+            self.assertEqual(list(query(db.cursor())), list(query(exam)), query.__name__)
+        self.assertEqual(list(unit_results(db.cursor(), 1002)), list(unit_results(exam, 1002)))
+        self.assertEqual(list(question_distribution(db)), list(question_distribution(exam)))
+        self.assertEqual(list(unit_distribution(db, "Unit 1")), list(unit_distribution(exam, "Unit 1")))
+        self.assertEqual(get_toetsformulier(db.cursor()), get_toetsformulier(exam))
+        self.assertEqual(student_scores(db.cursor()).markings, student_scores(exam).markings)
+
+    def test_blank_lines_are_skipped(self):
+        with open(self.input, "a") as csvfile:
+            csvfile.write("\n")
+        self.assertEqual([1001, 1002, 1003, 1004], ArrayExam.load(self.input).referenties)
+
+    def test_matrices(self):
+        exam = ArrayExam.load(self.input)
+        self.assertEqual([1001, 1002, 1003, 1004], exam.referenties)
+        self.assertEqual([[1, 2, 1], [0, 0, 1], [1, 1, 0], [0, 0, 0]], exam.scores.tolist())
+        self.assertEqual([True, True, True, False], exam.checked.all(axis=1).tolist())
+        self.assertEqual([12, 30, 8], exam.times[0].tolist())
+        self.assertEqual([1, 2, 3], exam.order[0].tolist())
+        self.assertEqual(["LO 1", "LO 2"], exam.learning_goal_labels)
+        self.assertEqual([0, 1, 1], exam.learning_goal_codes.tolist())
+
+    def test_unsupported_sections_are_rejected(self):
+        arguments = get_argument_parser().parse_args(["--input", self.input, "--engine", "numpy", "--distribution",
+                                                      "--student-detail"])
+        self.assertEqual(["--distribution", "--student-detail"], unsupported_arguments(arguments))
+        with self.assertRaises(SystemExit):
+            run(arguments)
+
+
+class IntegerAffinityTest(unittest.TestCase):
+    def test_like_sqlite(self):
+        db = open_database(":memory:")
+        values = ["1", "2.5", "3.0", "", "abc", 4.0, 4.5]
+        db.executemany("INSERT INTO Student(Referentie, Voornaam, Achternaam, Totaalscore) VALUES(?, '', '', ?)",
+                       enumerate(values))
+        stored = [totaalscore for totaalscore, in db.execute("SELECT Totaalscore FROM Student ORDER BY Referentie")]
+        self.assertEqual(stored, [integer_affinity(value) for value in values])
+        self.assertEqual([type(value) for value in stored], [type(integer_affinity(value)) for value in values])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+
+import json
+import os
+import unittest
+
+from export import *
+from surparser import open_database, read_csv
+from test_surparser import ExportTestCase
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ExportTest(ExportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = open_database(":memory:")
+        read_csv(self.input, self.db.cursor())
+        self.export_dir = os.path.join(self.directory.name, "export")
+
+    def tearDown(self):
+        self.db.close()
+        super().tearDown()
+
+    def test_chunks(self):
+        rows = [len(chunk) for chunk in chunks(self.db.cursor(), "SELECT * FROM Answer", 5)]
+        self.assertEqual([5, 5, 2], rows)
+
+    def test_ndjson(self):
+        filenames = export_tables(self.db, self.export_dir, "ndjson", chunk_size=5)
+        self.assertEqual([os.path.join(self.export_dir, f"{table}.ndjson") for table in EXPORT_TABLES], filenames)
+        with open(os.path.join(self.export_dir, "Answer.ndjson")) as answers:
+            rows = [json.loads(line) for line in answers]
+        self.assertEqual(12, len(rows))
+        self.assertEqual({"QuestionId": "1234P5679", "Referentie": 1001, "DaadwerkelijkeMarkering": 2,
+                          "Reactie": "A| C", "Weergavetijd": 30, "Volgorde": 2, "Nagekeken": "Ja"}, rows[1])
+
+    def test_column_types(self):
+        self.assertEqual(("Reactie", {"text"}), column_types(self.db, "Answer")[3])
+        self.assertEqual(("Referentie", {"integer"}), column_types(self.db, "Answer")[1])
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_parquet(self):
+        self.db.execute("UPDATE Answer SET Weergavetijd = '' WHERE Referentie = 1004")
+        export_tables(self.db, self.export_dir, "parquet", chunk_size=5)
+        answers = pyarrow.parquet.read_table(os.path.join(self.export_dir, "Answer.parquet"))
+        self.assertEqual(12, answers.num_rows)
+        self.assertEqual("int64", str(answers.schema.field("Referentie").type))
+        self.assertEqual("string", str(answers.schema.field("Weergavetijd").type))
+        self.assertEqual(["12", "30", "8"], answers.column("Weergavetijd").to_pylist()[:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
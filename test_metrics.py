@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+import unittest
+
+from metrics import *
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_per_label(self):
+        counter = self.registry.counter("conversions_total", "Conversions", ["format"])
+        counter.inc(format="html5")
+        counter.inc(2, format="html5")
+        counter.inc(format="pdf")
+        self.assertEqual(3, counter.value(format="html5"))
+        self.assertIn('conversions_total{format="html5"} 3\n', self.registry.expose())
+        self.assertIn('conversions_total{format="pdf"} 1\n', self.registry.expose())
+        self.assertIn("# TYPE conversions_total counter\n", self.registry.expose())
+
+    def test_labels_must_match(self):
+        counter = self.registry.counter("errors_total", "Errors", ["type"])
+        with self.assertRaises(ValueError):
+            counter.inc(format="html5")
+
+    def test_label_values_are_escaped(self):
+        self.registry.counter("errors_total", "Errors", ["type"]).inc(type='a "b"\n')
+        self.assertIn('errors_total{type="a \\"b\\"\\n"} 1\n', self.registry.expose())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram("duration_seconds", "Duration", buckets=[0.1, 1])
+        for value in [0.05, 0.1, 0.5, 5]:
+            histogram.observe(value)
+        self.assertEqual(4, histogram.count())
+        self.assertEqual("# HELP duration_seconds Duration\n"
+                         "# TYPE duration_seconds histogram\n"
+                         'duration_seconds_bucket{le="0.1"} 2\n'
+                         'duration_seconds_bucket{le="1"} 3\n'
+                         'duration_seconds_bucket{le="+Inf"} 4\n'
+                         "duration_seconds_sum 5.65\n"
+                         "duration_seconds_count 4\n", self.registry.expose())
+
+    def test_gauge_function_is_called_when_exposed(self):
+        values = [3]
+        self.registry.gauge("in_flight", "In flight", lambda: values[0])
+        self.assertIn("in_flight 3\n", self.registry.expose())
+        values[0] = 1
+        self.assertIn("in_flight 1\n", self.registry.expose())
+
+    def test_collector_is_called_once_per_scrape(self):
+        calls = []
+        queued = self.registry.gauge("queued", "Queued")
+        running = self.registry.gauge("running", "Running")
+
+        @self.registry.collector
+        def collect():
+            calls.append(None)
+            queued.set(2)
+            running.set(1)
+
+        exposed = self.registry.expose()
+        self.assertEqual(1, len(calls))
+        self.assertIn("queued 2\n", exposed)
+        self.assertIn("running 1\n", exposed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+#!/usr/bin/python3
+
+import os
+import unittest
+
+from plots import *
+from surparser import collect_plots, get_argument_parser, open_database, read_csv, student_scores
+from test_surparser import ExportTestCase
+
+
+class PlotTest(ExportTestCase):
+    def test_mark_levels_sort_numbers_before_text(self):
+        distribution = [("First question", [(0, 1), (1, 2)]), ("Second question", [(1, 1), ("0,5", 3), (2, 1)])]
+        self.assertEqual([0, 1, 2, "0,5"], mark_levels(distribution))
+
+    def test_render_plots_in_worker_pool(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        arguments = get_argument_parser().parse_args(["--all", "--cesuur", "55", "--plot-dir", self.directory.name])
+        arguments.units = True
+        plots = collect_plots(db, arguments, student_scores(db.cursor()))
+        self.assertEqual(["student_score", ("unit", "Unit 1"), ("unit", "Unit 2")], list(plots))
+        plot_files = render_plots(plots, jobs=2)
+        self.assertEqual(list(plots), list(plot_files))
+        self.assertEqual(("Unit 1", os.path.join(self.directory.name, "unit_Unit 1.png")), plot_files["unit", "Unit 1"])
+        self.assertTrue(os.path.exists(plot_files["student_score"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
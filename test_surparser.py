@@ -1,8 +1,79 @@
 #!/usr/bin/python3
 
+import argparse
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+import unittest.mock
+import warnings
+
+import numpy as np
 
 from surparser import *
+from writers import MarkdownWriter
+
+EXPORT_QUESTIONS = [
+    ("1234P5678", "First question", "1", "A", "Meerkeuzevraag", "Unit 1", "LO 1"),
+    ("1234P5679", "Second question", "2", "A| C", "Meerdere antwoorden", "Unit 1", "LO 2"),
+    ("1234P5680", "Third question", "1", "B", "Meerkeuzevraag", "Unit 2", "LO 2"),
+]
+EXPORT_STUDENTS = [
+    ("1001", "Anna", "Jansen", "4", "Voldoende", [("1", "A", "12", "1"), ("2", "A| C", "30", "2"), ("1", "B", "8", "3")]),
+    ("1002", "Bram", "Bakker", "1", "Onvoldoende", [("0", "B", "20", "2"), ("0", "C", "41", "1"), ("1", "B", "9", "3")]),
+    ("1003", "Anna", "Jansen", "2", "Onvoldoende", [("1", "A", "15", "3"), ("1", "A", "25", "1"), ("0", "", "5", "2")]),
+    ("1004", "Chris", "Visser", "0", "Ongeldig", [("0", "", "0", "1"), ("0", "", "0", "2"), ("0", "", "0", "3")]),
+]
+
+
+def write_decimal_comma_mark(filename, mark="1,5"):
+    """Replaces the mark of the first student for the second question of an export by mark."""
+
+    with open(filename, newline="") as csvfile:
+        rows = list(csv.reader(csvfile))
+    rows[1][rows[0].index(f"Daadwerkelijke markering [{EXPORT_QUESTIONS[1][0]}]")] = mark
+    with open(filename, "w", newline="") as csvfile:
+        csv.writer(csvfile).writerows(rows)
+
+
+def write_export(filename):
+    """Writes a small ItemsDeliveredRawReport.csv with four students and three questions."""
+
+    header = ["Referentie", "Voornaam", "Achternaam", "Geslacht", "Sleutelcode", "Daadwerkelijke markering",
+              "Totaalscore", "Cijfer", "Toetsformulier", "Toets", "Centrum", "Onderwerp"]
+    for question_id, *_ in EXPORT_QUESTIONS:
+        header += [f"{column} [{question_id}]" for column in
+                   ["Naam", "Totaalscore", "Sleutel", "Itemtype", "Scoretype", "Unit", "LO",
+                    "Daadwerkelijke markering", "Reactie", "Weergavetijd", "Gepresenteerde volgorde", "Nagekeken"]]
+    with open(filename, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header)
+        for referentie, voornaam, achternaam, markering, cijfer, answers in EXPORT_STUDENTS:
+            row = [referentie, voornaam, achternaam, "M", "ABCD1234", markering, "4", cijfer, "Formulier 1",
+                   "Toets 1", "Saxion", "Onderwerp"]
+            for (question_id, naam, totaalscore, sleutel, itemtype, unit, lo), answer in zip(EXPORT_QUESTIONS, answers):
+                nagekeken = "Nee" if cijfer == "Ongeldig" else "Ja"
+                row += [naam, totaalscore, sleutel, itemtype, "Standaard", unit, lo] + list(answer) + [nagekeken]
+            writer.writerow(row)
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.directory.name, "ItemsDeliveredRawReport.csv")
+        write_export(self.input)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def dump(db):
+        return [sorted(db.execute(f"SELECT * FROM {table}").fetchall(), key=repr)
+                for table in ["Student", "Toets", "Question", "Answer"]]
 
 
 class ParamParsingTestCase(unittest.TestCase):
@@ -41,6 +112,319 @@ class ParamParsingTestCase(unittest.TestCase):
         self.assertEqual("B", second_question["Sleutel"])
         self.assertEqual("Meerkeuze", second_question["ItemType"])
 
+    def test_column_plan(self):
+        header = list(self.params)
+        plan = column_plan(header)
+        self.assertEqual(header.index("Cijfer"), plan.cijfer)
+        self.assertEqual(["1234P5678", "1234P5679"], [question.question_id for question in plan.questions])
+        self.assertEqual(header.index("Sleutel [1234P5679]"), plan.questions[1].question[2])
+        self.assertIsNone(plan.questions[0].question[5])
+
+
+class ReadCsvTest(ExportTestCase):
+    def test_read_csv(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        self.assertEqual(4, db.execute("SELECT COUNT(*) FROM Student").fetchone()[0])
+        self.assertEqual(3, db.execute("SELECT COUNT(*) FROM Question").fetchone()[0])
+        self.assertEqual(12, db.execute("SELECT COUNT(*) FROM Answer").fetchone()[0])
+        self.assertEqual(("Formulier 1", "Toets 1", 4), get_toetsformulier(db.cursor()))
+
+    def test_blank_lines_are_skipped(self):
+        with open(self.input, "a") as csvfile:
+            csvfile.write("\n\n")
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        self.assertEqual(4, db.execute("SELECT COUNT(*) FROM Student").fetchone()[0])
+        bulk_loaded = open_database(":memory:")
+        bulk_load(bulk_loaded, self.input)
+        self.assertEqual(self.dump(db), self.dump(bulk_loaded))
+
+    def test_bulk_load_matches_read_csv(self):
+        expected = open_database(":memory:")
+        read_csv(self.input, expected.cursor())
+        db = open_database(":memory:")
+        timings = bulk_load(db, self.input)
+        self.assertEqual(["parse", "insert", "commit"], [phase for phase, _ in timings])
+        self.assertEqual(self.dump(expected), self.dump(db))
+
+    def test_bulk_load_restores_pragmas(self):
+        db = open_database(os.path.join(self.directory.name, "surparser.db"))
+        bulk_load(db, self.input)
+        self.assertEqual("delete", db.execute("PRAGMA journal_mode").fetchone()[0])
+        self.assertEqual(2, db.execute("PRAGMA synchronous").fetchone()[0])
+        db.close()
+
+    def test_failed_bulk_load_is_rolled_back(self):
+        db = open_database(os.path.join(self.directory.name, "surparser.db"))
+        with unittest.mock.patch("surparser.insert_answer", side_effect=RuntimeError("disk full")):
+            with self.assertRaises(RuntimeError):
+                bulk_load(db, self.input)
+        self.assertEqual(0, db.execute("SELECT COUNT(*) FROM Student").fetchone()[0])
+        self.assertEqual("ok", db.execute("PRAGMA integrity_check").fetchone()[0])
+        db.close()
+
+
+class CacheTest(ExportTestCase):
+    def load(self, db, input_filename):
+        self.loads += 1
+        read_csv(input_filename, db.cursor())
+        db.commit()
+
+    def test_second_run_is_a_cache_hit(self):
+        self.loads = 0
+        cache_dir = os.path.join(self.directory.name, "cache")
+        db, hit = cached_database(cache_dir, self.input, self.load, 1 << 30)
+        self.assertFalse(hit)
+        db.close()
+        db, hit = cached_database(cache_dir, self.input, self.load, 1 << 30)
+        self.assertTrue(hit)
+        self.assertEqual(1, self.loads)
+        self.assertEqual(12, db.execute("SELECT COUNT(*) FROM Answer").fetchone()[0])
+        db.close()
+
+    def test_failed_load_leaves_no_temporary_file(self):
+        def load(db, input_filename):
+            raise ValueError(input_filename)
+
+        cache_dir = os.path.join(self.directory.name, "cache")
+        with self.assertRaises(ValueError):
+            cached_database(cache_dir, self.input, load, 1 << 30)
+        self.assertEqual([], os.listdir(cache_dir))
+
+    def test_entries_evicted_concurrently_are_skipped(self):
+        self.loads = 0
+        cache_dir = os.path.join(self.directory.name, "cache")
+        for digest in ["a", "b"]:
+            db, _ = cached_database(cache_dir, self.input, self.load, 1 << 30, digest)
+            db.close()
+        with unittest.mock.patch("os.remove", side_effect=FileNotFoundError):
+            evict_cache(cache_dir, 0)
+        with unittest.mock.patch("os.stat", side_effect=FileNotFoundError):
+            evict_cache(cache_dir, 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.loads = 0
+        cache_dir = os.path.join(self.directory.name, "cache")
+        for digest in ["a", "b", "c"]:
+            db, _ = cached_database(cache_dir, self.input, self.load, 1 << 30, digest)
+            db.close()
+        os.utime(os.path.join(cache_dir, f"a-v{SCHEMA_VERSION}.db"), (0, 0))
+        size = os.path.getsize(os.path.join(cache_dir, f"b-v{SCHEMA_VERSION}.db"))
+        evict_cache(cache_dir, 2 * size)
+        self.assertEqual([f"b-v{SCHEMA_VERSION}.db", f"c-v{SCHEMA_VERSION}.db"], sorted(os.listdir(cache_dir)))
+
+
+class AppendTest(ExportTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(self.input) as csvfile:
+            header, *rows = csvfile.readlines()
+        self.parts = []
+        for index, part in enumerate([rows[:2], rows[2:]]):
+            self.parts.append(os.path.join(self.directory.name, f"part{index}.csv"))
+            with open(self.parts[-1], "w") as csvfile:
+                csvfile.writelines([header] + part)
+        self.db_filename = os.path.join(self.directory.name, "toetsen.db")
+
+    def load(self, db, input_filename):
+        read_csv(input_filename, db.cursor())
+        db.commit()
+
+    def test_appending_parts_equals_loading_the_whole_export(self):
+        expected = open_database(":memory:")
+        self.load(expected, self.input)
+        for part in self.parts:
+            db = open_database(self.db_filename, clear=False)
+            self.assertTrue(ingest(db, part, self.load))
+            db.close()
+        db = open_database(self.db_filename, clear=False)
+        self.assertEqual(self.dump(expected), self.dump(db))
+        self.assertEqual(2, db.execute("SELECT COUNT(*) FROM Source").fetchone()[0])
+
+    def test_ingesting_a_file_twice_is_a_no_op(self):
+        db = open_database(self.db_filename)
+        self.assertTrue(ingest(db, self.input, self.load))
+        statements = []
+        db.set_trace_callback(statements.append)
+        self.assertFalse(ingest(db, self.input, self.load))
+        self.assertEqual(1, len(statements))
+
+    def test_changed_answers_are_updated(self):
+        db = open_database(self.db_filename)
+        self.load(db, self.input)
+        db.execute("UPDATE Answer SET DaadwerkelijkeMarkering = 0 WHERE Referentie = 1001")
+        rowids = db.execute("SELECT rowid FROM Answer ORDER BY rowid").fetchall()
+        self.load(db, self.parts[0])
+        self.assertEqual(4, db.execute("SELECT SUM(DaadwerkelijkeMarkering) FROM Answer WHERE Referentie = 1001")
+                         .fetchone()[0])
+        self.assertEqual(rowids, db.execute("SELECT rowid FROM Answer ORDER BY rowid").fetchall())
+
+    def test_duplicate_answers_of_an_old_database_are_removed(self):
+        db = open_database(self.db_filename)
+        self.load(db, self.input)
+        db.execute("DROP INDEX AnswerKey")
+        db.execute("INSERT INTO Answer SELECT * FROM Answer")
+        db.commit()
+        db.close()
+        db = open_database(self.db_filename, clear=False)
+        self.assertEqual(12, db.execute("SELECT COUNT(*) FROM Answer").fetchone()[0])
+
+
+class ExplainTest(ExportTestCase):
+    def test_answer_queries_use_indexes(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        statements = []
+        db.set_trace_callback(statements.append)
+        list(unit_question(db.cursor(), "1234P5678"))
+        list(answers(db.cursor(), 1001))
+        db.set_trace_callback(None)
+        output = io.StringIO()
+        explain(db, statements, output)
+        self.assertIn("USING COVERING INDEX AnswerQuestion", output.getvalue())
+        self.assertIn("USING INDEX AnswerStudent", output.getvalue())
+        self.assertNotIn("SCAN Answer", output.getvalue())
+
+    def test_query_is_explained_once_for_all_parameters(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        statements = []
+        db.set_trace_callback(statements.append)
+        for referentie in [1001, 1002, 1003]:
+            list(answers(db.cursor(), referentie))
+        db.set_trace_callback(None)
+        self.assertEqual(3, len(set(statements)))
+        output = io.StringIO()
+        explain(db, statements, output)
+        self.assertEqual(1, output.getvalue().count("USING INDEX AnswerStudent"))
+
+    def test_distribution_queries_are_explained(self):
+        stderr = io.StringIO()
+        with unittest.mock.patch("sys.stderr", stderr):
+            run(get_argument_parser().parse_args(["--input", self.input, "--output", os.devnull, "--explain",
+                                                  "--distribution"]))
+        explained = [block.split("\n", 1)[0] for block in stderr.getvalue().split("\n\n")]
+        self.assertEqual(2, sum(statement.startswith("WITH Totals AS") for statement in explained))
+
+    def test_normalize_statement(self):
+        self.assertEqual("SELECT * FROM Answer WHERE Referentie = ? AND Reactie = ? AND Unit2 = ?",
+                         normalize_statement("SELECT *\n  FROM Answer\n WHERE Referentie = 1001 AND Reactie = 'it''s'"
+                                             " AND Unit2 = 2.5"))
+
+
+class StudentDetailTest(ExportTestCase):
+    @staticmethod
+    def per_student_detail(cursor, output):
+        """The student detail section built with one query per student and table."""
+
+        print("Gemaakte toetsen", file=output)
+        print("================", file=output)
+        print(file=output)
+        for voornaam, achternaam, referentie in list(students(cursor)):
+            name = " ".join([voornaam, achternaam])
+            print(name, file=output)
+            print("-" * len(name), file=output)
+            print(file=output)
+            print("Unit                            | Aantal | Percentage", file=output)
+            print("------------------------------- | ------:| ----------:", file=output)
+            for unit, count, percentage in unit_results(cursor, referentie):
+                if unit:
+                    print(f"{unit} | {count:.0f} | {percentage:.1f}", file=output)
+            print(file=output)
+            print("Leerdoel                                                  | Aantal | Percentage", file=output)
+            print("--------------------------------------------------------- | ------:| -----------:", file=output)
+            for lo, count, percentage in learning_goals(cursor, referentie):
+                if lo:
+                    print("{} | {:.0f} | {:.1f}".format(lo.replace("|", "/"), count, percentage), file=output)
+            print(file=output)
+            print("Vraag                 | Gegeven antwoord (Goede antwoord)                     | Behaalde score / Max score", file=output)
+            print("--------------------- | ----------------------------------------------------- | --------------------------:", file=output)
+            for Naam, Reactie, Sleutel, DaadwerkelijkeMarkering, TotaalScore in answers(cursor, referentie):
+                print("{} | {} ({}) | {} / {}".format(
+                    Naam, Reactie.replace("|", "/"), Sleutel.replace("|", "/"), DaadwerkelijkeMarkering, TotaalScore
+                ), file=output)
+        print(file=output)
+
+    def test_output_is_identical_to_per_student_queries(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        expected = io.StringIO()
+        self.per_student_detail(db.cursor(), expected)
+        output = io.StringIO()
+        output_student_detail(db.cursor(), MarkdownWriter(output))
+        self.assertEqual(expected.getvalue(), output.getvalue())
+        self.assertEqual(3, output.getvalue().count("Anna Jansen\n") + output.getvalue().count("Bram Bakker\n"))
+
+    def test_uses_constant_number_of_queries(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        statements = []
+        db.set_trace_callback(statements.append)
+        output_student_detail(db.cursor(), MarkdownWriter(io.StringIO()))
+        self.assertEqual(4, len(statements))
+
+
+class DistributionTest(ExportTestCase):
+    def test_distribution(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        choices, questions = distribution(db.cursor())
+        self.assertEqual(["A", "B", "C"], choices)
+        self.assertEqual([
+            ("First question", "A", {"A": 2, "B": 1, "C": 0}),
+            ("Second question", "A| C", {"A": 2, "B": 0, "C": 2}),
+            ("Third question", "B", {"A": 0, "B": 2, "C": 0}),
+        ], questions)
+
+    def test_distractor_analysis_matches_per_student_computation(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        matrix = score_matrix(db.cursor())
+        totals = matrix.scores.sum(axis=1)
+        responses = {(referentie, question_id): reactie for referentie, question_id, reactie in db.execute(
+            "SELECT Referentie, QuestionId, Reactie FROM Answer WHERE Nagekeken = 'Ja'")}
+        question_ids = [question_id for question_id, *_ in EXPORT_QUESTIONS]
+        distractors = distractor_analysis(db.cursor())
+        self.assertEqual([("First question", "A"), ("First question", "B"), ("Second question", "A"),
+                          ("Second question", "C"), ("Third question", "B")],
+                         [(distractor.question, distractor.choice) for distractor in distractors])
+        self.assertEqual([True, False, True, True, True], [distractor.correct for distractor in distractors])
+        for distractor in distractors:
+            item = matrix.names.index(distractor.question)
+            chosen = np.array([distractor.choice in responses[referentie, question_ids[item]].split("| ")
+                               for referentie in matrix.referenties])
+            self.assertEqual(chosen.sum(), distractor.count)
+            self.assertAlmostEqual(totals[chosen].mean(), distractor.mean_total)
+            self.assertAlmostEqual(np.corrcoef(chosen, totals - matrix.scores[:, item])[0, 1],
+                                   distractor.point_biserial)
+
+    def test_distribution_uses_constant_number_of_queries(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        statements = []
+        db.set_trace_callback(statements.append)
+        output_distribution(db.cursor(), MarkdownWriter(io.StringIO()))
+        self.assertEqual(4, len(statements))
+
+
+class ImportTest(unittest.TestCase):
+    def test_import_does_not_load_plotting_libraries(self):
+        loaded = subprocess.run(
+            [sys.executable, "-c", "import sys, surparser; print(sorted(sys.modules))"],
+            stdout=subprocess.PIPE, universal_newlines=True, check=True
+        ).stdout
+        self.assertNotIn("'matplotlib'", loaded)
+        self.assertNotIn("'numpy'", loaded)
+        self.assertNotIn("'plots'", loaded)
+
+    def test_plots_does_not_import_surparser(self):
+        loaded = subprocess.run(
+            [sys.executable, "-c", "import sys, plots; print(sorted(sys.modules))"],
+            stdout=subprocess.PIPE, universal_newlines=True, check=True
+        ).stdout
+        self.assertNotIn("'surparser'", loaded)
+
 
 class MarkTest(unittest.TestCase):
     def test_lowest_mark_is_one(self):
@@ -70,6 +454,170 @@ class MarkTest(unittest.TestCase):
                                            score(mark(actualscore, cesuur / 100.0, totalscore), cesuur / 100.0,
                                                  totalscore))
 
+    def test_mark_array_matches_mark(self):
+        for cesuur in range(10, 100, 7):
+            for totalscore in range(1, 100, 9):
+                actualscores = np.linspace(-1, totalscore + 1, 50)
+                self.assertEqual([mark(actualscore, cesuur / 100.0, totalscore) for actualscore in actualscores],
+                                 list(mark_array(actualscores, cesuur / 100.0, totalscore)))
+
+    def test_score_array_matches_score(self):
+        marks = np.linspace(0, 11, 45)
+        for cesuur in range(10, 100, 7):
+            for totalscore in range(1, 100, 9):
+                self.assertEqual([score(m, cesuur / 100.0, totalscore) for m in marks],
+                                 list(score_array(marks, cesuur / 100.0, totalscore)))
+
+
+class StudentScoresTest(ExportTestCase):
+    def test_pass_percentage(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        scores = student_scores(db.cursor())
+        self.assertEqual(["Anna", "Anna", "Bram"], scores.first_names)
+        self.assertEqual([4, 2, 1], list(scores.scores))
+        self.assertAlmostEqual(100.0 / 3, pass_percentage(scores, 0.55))
+
+    def test_cesuur_sweep_matches_pass_percentage(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        scores = student_scores(db.cursor())
+        cesuurs = cesuur_range("20:80:2.5")
+        self.assertEqual(25, len(cesuurs))
+        sweep = cesuur_sweep(scores, cesuurs)
+        for cesuur, percentage, mean_mark, histogram in zip(*sweep):
+            marks = [mark(actualscore, cesuur / 100.0, 4) for actualscore in [4, 2, 1]]
+            self.assertAlmostEqual(pass_percentage(scores, cesuur / 100.0), percentage)
+            self.assertAlmostEqual(sum(marks) / 3, mean_mark)
+            self.assertEqual(3, sum(histogram))
+            self.assertEqual(1, histogram[round(marks[0]) - 1])
+
+    def test_cesuur_range_is_limited_to_valid_cesuurs(self):
+        for value in ["50:100:5", "0:50:5", "-10:50:5"]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                cesuur_range(value)
+        self.assertEqual([5.0, 95.0], cesuur_range("5:95:90"))
+
+
+class ItemAnalysisTest(ExportTestCase):
+    def test_score_matrix(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        matrix = score_matrix(db.cursor())
+        self.assertEqual([1001, 1002, 1003], list(matrix.referenties))
+        self.assertEqual(["First question", "Second question", "Third question"], matrix.names)
+        self.assertEqual([[1, 2, 1], [0, 0, 1], [1, 1, 0]], matrix.scores.tolist())
+
+    def test_decimal_comma_marks(self):
+        write_decimal_comma_mark(self.input)
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        self.assertEqual([1, 1.5, 1], score_matrix(db.cursor()).scores[0].tolist())
+        self.assertEqual([1, 1.5, 1], time_matrix(db.cursor()).scores[0].tolist())
+        output = os.path.join(self.directory.name, "toetsanalyse.md")
+        run(get_argument_parser().parse_args(["--input", self.input, "--output", output, "--all", "--cesuur", "55"]))
+        with open(output) as report:
+            self.assertIn("Itemanalyse", report.read())
+
+    def test_matches_per_item_computation(self):
+        scores = np.random.RandomState(0).randint(0, 3, size=(50, 8)).astype(float)
+        analysis = item_analysis(ScoreMatrix(np.arange(50), [f"Vraag {item}" for item in range(8)], np.full(8, 2.0),
+                                             scores))
+
+        def alpha(matrix):
+            items = matrix.shape[1]
+            return items / (items - 1) * (1 - matrix.var(axis=0, ddof=1).sum() / matrix.sum(axis=1).var(ddof=1))
+
+        totals = scores.sum(axis=1)
+        self.assertAlmostEqual(alpha(scores), analysis.alpha)
+        for item in range(8):
+            rest = np.delete(scores, item, axis=1)
+            self.assertAlmostEqual(scores[:, item].mean() / 2, analysis.p_values[item])
+            self.assertAlmostEqual(np.corrcoef(scores[:, item], totals)[0, 1], analysis.rit[item])
+            self.assertAlmostEqual(np.corrcoef(scores[:, item], rest.sum(axis=1))[0, 1], analysis.rir[item])
+            self.assertAlmostEqual(alpha(rest), analysis.alpha_if_deleted[item])
+
+
+    def test_small_exports(self):
+        from benchmark import generate_export
+
+        for students, questions in [(1, 1), (1, 2), (5, 1), (5, 2)]:
+            generate_export(self.input, students=students, questions=questions, seed=1)
+            for output_format in ["markdown", "json"]:
+                output = os.path.join(self.directory.name, f"toetsanalyse.{output_format}")
+                argv = ["--input", self.input, "--output", output, "--all", "--cesuur", "55", "--format",
+                        output_format]
+                with warnings.catch_warnings():
+                    warnings.simplefilter("error")
+                    run(get_argument_parser().parse_args(argv))
+                with open(output) as report:
+                    text = report.read()
+                self.assertNotIn("nan", text.lower(), (students, questions, output_format))
+                if output_format == "json":
+                    json.loads(text, parse_constant=self.fail)
+
+
+class TimingTest(ExportTestCase):
+    def test_time_matrix(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        matrix = time_matrix(db.cursor())
+        self.assertEqual([[12, 30, 8], [20, 41, 9], [15, 25, 5]], matrix.times.tolist())
+        self.assertEqual([[1, 2, 3], [2, 1, 3], [3, 1, 2]], matrix.positions.tolist())
+
+    def test_timing_analysis(self):
+        db = open_database(":memory:")
+        read_csv(self.input, db.cursor())
+        analysis = timing_analysis(time_matrix(db.cursor()))
+        self.assertEqual([15, 30, 8], analysis.medians.tolist())
+        self.assertAlmostEqual(19, analysis.p90s[0])
+        self.assertAlmostEqual(np.corrcoef([12, 20, 15], [1, 0, 1])[0, 1], analysis.correlations[0])
+        self.assertEqual([False, False, False], analysis.long.tolist())
+        self.assertEqual([1, 2, 3], analysis.positions.tolist())
+        self.assertEqual([3, 3, 3], analysis.position_answers.tolist())
+        self.assertAlmostEqual((12 + 41 + 25) / 3, analysis.position_times[0])
+        self.assertAlmostEqual(100 * (1 + 0 + 1 / 2) / 3, analysis.position_scores[0])
+
+    def test_unusually_long_questions_are_flagged(self):
+        times = np.tile(np.array([20.0, 22, 25, 21, 90, 24]), (10, 1))
+        analysis = timing_analysis(TimeMatrix([f"Vraag {item}" for item in range(6)], np.ones(6), np.ones((10, 6)),
+                                              times, np.tile(np.arange(1.0, 7), (10, 1))))
+        self.assertEqual([False, False, False, False, True, False], analysis.long.tolist())
+
+    def test_missing_times_are_ignored(self):
+        times = np.array([[10.0, np.nan], [20, 30], [np.nan, 40]])
+        analysis = timing_analysis(TimeMatrix(["a", "b"], np.ones(2), np.array([[1.0, 0], [0, 0], [1, 1]]), times,
+                                              np.array([[1.0, 2], [2, 1], [1, 2]])))
+        self.assertEqual([15, 35], analysis.medians.tolist())
+        self.assertEqual([-1, 1], np.round(analysis.correlations, 9).tolist())
+        self.assertEqual([2, 2], analysis.position_answers.tolist())
+
+
+class ProfileTest(ExportTestCase):
+    def test_every_section_gets_a_span(self):
+        output = os.path.join(self.directory.name, "toetsanalyse.md")
+        arguments = get_argument_parser().parse_args(["--input", self.input, "--output", output, "--all",
+                                                      "--cesuur", "55"])
+        profile = run(arguments)
+        spans = {span.name: span for span in profile.spans}
+        self.assertEqual(["load", "student_scores", "output_toets"], [span.name for span in profile.spans[:3]])
+        self.assertIn("output_student_detail", spans)
+        self.assertEqual("close", profile.spans[-1].name)
+        self.assertEqual(4, spans["output_student_detail"].queries)
+        self.assertEqual(3, spans["output_student_score"].rows)
+        self.assertLessEqual(sum(span.queries for span in profile.spans), profile.queries)
+
+    def test_nested_spans_are_not_counted_in_the_total(self):
+        profile = Profile()
+        with profile.span("render_plots"):
+            pass
+        profile.add("student_score", 1.0, "render_plots")
+        summary = io.StringIO()
+        profile.output_summary(summary)
+        self.assertIn("render_plots / student_score | 1.000", summary.getvalue())
+        self.assertNotIn("Totaal | 1.", summary.getvalue())
+        self.assertNotIn("student_score=", profile.summary_line())
+
 
 if __name__ == '__main__':
     unittest.main()
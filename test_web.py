@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+from concurrent.futures import ThreadPoolExecutor
+
+from test_surparser import write_export
+from web import *
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = JobQueue(2, "thread")
+        self.release = threading.Event()
+        self.calls = 0
+
+    def job(self, value):
+        self.calls += 1
+        self.release.wait(5)
+        if value is None:
+            raise ValueError("no value")
+        return value * 2
+
+    def test_duplicate_jobs_run_once(self):
+        self.queue.submit("a", self.job, 21)
+        self.queue.submit("a", self.job, 21)
+        self.assertIn(self.queue.status("a"), ["queued", "running"])
+        self.release.set()
+        self.assertEqual(42, self.queue.result("a"))
+        self.assertEqual("done", self.queue.status("a"))
+        self.assertEqual(1, self.calls)
+
+    def test_failed_job_is_reported_and_can_be_resubmitted(self):
+        self.release.set()
+        self.queue.submit("b", self.job, None)
+        self.queue.jobs["b"].exception()
+        self.assertEqual("failed", self.queue.status("b"))
+        self.assertEqual("ValueError: no value", self.queue.error("b"))
+        self.queue.submit("b", self.job, 1)
+        self.assertEqual(2, self.queue.result("b"))
+
+    def test_jobs_are_forgotten_when_their_directory_is_removed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.release.set()
+        self.queue.submit("d", self.job, 1, directory=directory.name)
+        self.queue.result("d")
+        self.queue.prune()
+        self.assertEqual("done", self.queue.status("d"))
+        directory.cleanup()
+        self.queue.prune()
+        self.assertIsNone(self.queue.status("d"))
+        self.assertEqual({}, self.queue.directories)
+
+    def test_workers_are_initialized(self):
+        initialized = []
+        job_queue = JobQueue(1, "thread", initialized.append, ("limiter",))
+        job_queue.submit("c", self.job, 1)
+        self.release.set()
+        self.assertEqual(2, job_queue.result("c"))
+        self.assertEqual(["limiter"], initialized)
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.queue.status("unknown"))
+
+    def test_job_key_depends_on_options_and_format(self):
+        self.assertEqual(job_key("md5", ["--all"], "pdf"), job_key("md5", ["--all"], "pdf"))
+        self.assertNotEqual(job_key("md5", ["--all"], "pdf"), job_key("md5", ["--all"], "html5"))
+        self.assertNotEqual(job_key("md5", ["--all"], "pdf"), job_key("md5", ["--units"], "pdf"))
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.upload_dir = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def upload(self, name, size, age):
+        directory = os.path.join(self.upload_dir, name)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "ItemsDeliveredRawReport.csv"), "wb") as csv_file:
+            csv_file.write(b"x" * size)
+        mtime = time.time() - age
+        os.utime(directory, (mtime, mtime))
+        return directory
+
+    def test_normalize_arguments_ignores_order(self):
+        self.assertEqual(normalize_arguments(["--units", "--cesuur", "55.0", "--all"]),
+                         normalize_arguments(["--all", "--cesuur", "55.0", "--units"]))
+        self.assertEqual([["--all", None], ["--cesuur", "55.0"]], normalize_arguments(["--cesuur", "55.0", "--all"]))
+
+    def test_options_key_ignores_format(self):
+        options = normalize_arguments(["--all"])
+        self.assertEqual(options_key(options), options_key(normalize_arguments(["--all"])))
+        self.assertNotEqual(options_key(options), options_key(normalize_arguments(["--units"])))
+
+    def test_evict_old_uploads(self):
+        old = self.upload("old", 10, 100)
+        new = self.upload("new", 10, 0)
+        evict_static(self.upload_dir, 50, 1000)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_evict_least_recently_used_above_quota(self):
+        oldest = self.upload("oldest", 100, 30)
+        old = self.upload("old", 100, 20)
+        new = self.upload("new", 100, 10)
+        self.assertEqual(100, evict_static(self.upload_dir, 1000, 150, keep={os.path.normpath(oldest)}))
+        self.assertTrue(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+
+    def test_directories_in_progress_are_not_walked(self):
+        active = self.upload("active", 100, 0)
+        with unittest.mock.patch("os.walk", side_effect=AssertionError("walked")) as walk:
+            self.assertEqual(0, evict_static(self.upload_dir, 1000, 0, keep={os.path.normpath(active)}))
+        walk.assert_not_called()
+
+    def test_files_that_disappear_while_sizing_are_skipped(self):
+        new = self.upload("new", 100, 0)
+        with unittest.mock.patch("os.path.getsize", side_effect=FileNotFoundError):
+            self.assertEqual(0, directory_size(new))
+
+
+class UploadTest(unittest.TestCase):
+    HEADER = b"Referentie,Voornaam,Naam [1P1],Totaalscore [1P1]\n"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.upload_dir = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_upload_is_stored_by_md5(self):
+        data = self.HEADER + b"1,Anna,Vraag 1,1\n" * 100
+        md5 = save_upload(io.BytesIO(data), self.upload_dir, 1 << 20, chunk_size=16)
+        self.assertEqual(hashlib.md5(data).hexdigest(), md5)
+        with open(os.path.join(self.upload_dir, md5, "ItemsDeliveredRawReport.csv"), "rb") as csv_file:
+            self.assertEqual(data, csv_file.read())
+        self.assertEqual(md5, save_upload(io.BytesIO(data), self.upload_dir, 1 << 20))
+        self.assertEqual([md5], os.listdir(self.upload_dir))
+
+    def test_too_large_upload_is_rejected(self):
+        with self.assertRaises(UploadError) as context:
+            save_upload(io.BytesIO(self.HEADER + b"x" * 100), self.upload_dir, 64, chunk_size=16)
+        self.assertEqual(413, context.exception.status)
+        self.assertEqual([], os.listdir(self.upload_dir))
+
+    def test_non_csv_upload_is_rejected(self):
+        for data in [b"\x89PNG\r\n\x1a\n\xff\xfe", b"a,b,c\n1,2,3\n"]:
+            with self.assertRaises(UploadError) as context:
+                save_upload(io.BytesIO(data), self.upload_dir, 1 << 20)
+            self.assertEqual(400, context.exception.status)
+        self.assertEqual([], os.listdir(self.upload_dir))
+
+
+class RenderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.directory.name, "ItemsDeliveredRawReport.csv")
+        write_export(self.input)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def convert(self, output_format, extension):
+        output_filename = os.path.join(self.directory.name, "options", output_format, "toetsanalyse." + extension)
+        argv = ["--all", "--cesuur", "55", "--input", self.input,
+                "--cache-dir", os.path.join(self.directory.name, "cache")]
+        self.assertEqual(output_filename, convert_job(argv, None, output_format, output_filename).filename)
+        with open(output_filename) as output_file:
+            return output_file.read()
+
+    def test_concurrent_jobs_share_the_markdown(self):
+        argv = ["--all", "--cesuur", "55", "--input", self.input,
+                "--cache-dir", os.path.join(self.directory.name, "cache")]
+        options_directory = os.path.join(self.directory.name, "options")
+        for trial in range(5):
+            shutil.rmtree(options_directory, ignore_errors=True)
+            with ThreadPoolExecutor(2) as executor:
+                jobs = [executor.submit(convert_job, argv, None, "markdown",
+                                        os.path.join(options_directory, f"markdown{job}", "toetsanalyse.md"))
+                        for job in range(2)]
+                for job in jobs:
+                    job.result()
+            self.assertEqual([], [filename for _, _, filenames in os.walk(options_directory)
+                                  for filename in filenames if filename.endswith(".tmp")])
+
+    def test_markdown_is_rendered_without_pandoc(self):
+        markdown = self.convert("markdown", "md")
+        with open(os.path.join(self.directory.name, "options", "toetsanalyse.md")) as markdown_file:
+            self.assertEqual(markdown_file.read(), markdown)
+
+    def test_html_is_rendered_without_pandoc(self):
+        document = self.convert("html5", "html")
+        self.assertIn("<td>Slagingspercentage</td>", document)
+        self.assertIn('<th style="text-align: right;">Percentage</th>', document)
+        self.assertEqual(2, document.count("<h2>Anna Jansen</h2>"))
+
+    def test_html_does_not_need_the_markdown(self):
+        self.convert("html5", "html")
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "options", "toetsanalyse.md")))
+
+
+class MetricsEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.directory.name, "ItemsDeliveredRawReport.csv")
+        write_export(self.input)
+        self.upload_dir = os.path.join(self.directory.name, "static")
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def post(self, output_format="markdown"):
+        with open(self.input, "rb") as csv_file:
+            return self.client.post("/convert", data={"input": (csv_file, "export.csv"), "output-format": output_format,
+                                                      "student-score": "on"})
+
+    def test_unknown_output_format_is_rejected(self):
+        import web
+
+        errors_before = errors.value(type="upload_400")
+        uploads_before = upload_bytes.count()
+        with unittest.mock.patch.object(web, "UPLOAD_DIR", self.upload_dir), \
+                unittest.mock.patch.object(web, "output_formats", lambda: ["html5", "markdown"]):
+            self.assertEqual(400, self.post('evil"format').status_code)
+        self.assertEqual(errors_before + 1, errors.value(type="upload_400"))
+        self.assertEqual(uploads_before, upload_bytes.count())
+        self.assertEqual(0, conversions.value(format='evil"format'))
+        self.assertFalse(os.path.exists(self.upload_dir))
+
+    def test_conversions_are_measured(self):
+        import web
+
+        job_queue = JobQueue(1, "thread")
+        with unittest.mock.patch.object(web, "UPLOAD_DIR", self.upload_dir), \
+                unittest.mock.patch.object(web, "CACHE_DIR", os.path.join(self.directory.name, "cache")), \
+                unittest.mock.patch.object(web, "output_formats", lambda: ["html5", "markdown"]), \
+                unittest.mock.patch.object(web, "queue", job_queue):
+            conversions_before = conversions.value(format="markdown")
+            ingested_before = ingest_seconds.count()
+            self.assertEqual(303, self.post().status_code)
+            job_queue.executor.shutdown(wait=True)
+            self.assertEqual(303, self.post().status_code)
+            exposed = self.client.get("/metrics")
+        self.assertEqual(metrics.CONTENT_TYPE, exposed.headers["Content-Type"])
+        self.assertEqual(conversions_before + 2, conversions.value(format="markdown"))
+        self.assertEqual(ingested_before + 1, ingest_seconds.count())
+        self.assertIn('surparser_render_seconds_count{format="markdown"}', exposed.get_data(as_text=True))
+        self.assertIn('surparser_cache_hits_total{format="markdown"}', exposed.get_data(as_text=True))
+        self.assertIn("surparser_conversions_in_flight 0\n", exposed.get_data(as_text=True))
+        self.assertIn("surparser_static_bytes ", exposed.get_data(as_text=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+import io
+import json
+import unittest
+
+from writers import *
+
+SECTION = Section("Vragen", [
+    Heading("Anna Jansen"),
+    Table([Column("Vraag", width=7), Column("Aantal", "right", format=".0f"), Column("A"), Column("B")],
+          [("Eerste | vraag", 2.0, Strong(2), None), ("Tweede", 1.0, 1, Strong(3))]),
+    Table([Column("", width=6), Column("", width=4)], [("Toets", "Toets 1"), ("Max", 4)]),
+])
+
+
+class UnclosedStringIO(io.StringIO):
+    def close(self):
+        pass
+
+
+class WriterTest(unittest.TestCase):
+    def write(self, writer_class):
+        output = UnclosedStringIO()
+        writer = writer_class(output)
+        writer.write(SECTION)
+        writer.close()
+        return output.getvalue()
+
+    def test_markdown(self):
+        self.assertEqual("\n".join([
+            "Vragen",
+            "======",
+            "",
+            "Anna Jansen",
+            "-----------",
+            "",
+            "Vraag   | Aantal | A | B",
+            "------- | ------:| - | -",
+            "Eerste / vraag | 2 | **2** | ",
+            "Tweede | 1 | 1 | **3**",
+            "",
+            "------   ----",
+            "Toets    Toets 1",
+            "Max      4",
+            "------   ----",
+            "",
+            ""
+        ]), self.write(MarkdownWriter))
+
+    def test_markdown_table_before_heading(self):
+        output = UnclosedStringIO()
+        MarkdownWriter(output).write(Section("Studenten", [
+            Table([Column("Score  ", width=4), Column("Cijfer")], [("1.0", 1)]),
+            Heading("Anna Jansen"),
+        ]))
+        self.assertEqual("\n".join([
+            "Studenten",
+            "=========",
+            "",
+            "Score   | Cijfer",
+            "----    | ------",
+            "1.0 | 1",
+            "Anna Jansen",
+            "-----------",
+            "",
+            ""
+        ]), output.getvalue())
+
+    def test_html(self):
+        document = self.write(HtmlWriter)
+        self.assertIn("<h2>Anna Jansen</h2>", document)
+        self.assertIn('<th style="text-align: right;">Aantal</th>', document)
+        self.assertIn('<tr><td>Eerste | vraag</td><td style="text-align: right;">2</td>'
+                      '<td><strong>2</strong></td><td></td></tr>', document)
+
+    def test_csv(self):
+        self.assertEqual("\n".join([
+            "Vragen,Anna Jansen",
+            "Vraag,Aantal,A,B",
+            "Eerste | vraag,2.0,2,",
+            "Tweede,1.0,1,3",
+            "",
+            "Vragen,Anna Jansen",
+            "Toets,Toets 1",
+            "Max,4",
+            "",
+            ""
+        ]), self.write(CsvWriter))
+
+    def test_json(self):
+        document = json.loads(self.write(JsonWriter))
+        self.assertEqual(["Vragen"], [section["title"] for section in document["sections"]])
+        heading, table, _ = document["sections"][0]["blocks"]
+        self.assertEqual({"heading": "Anna Jansen"}, heading)
+        self.assertEqual(["Vraag", "Aantal", "A", "B"], table["columns"])
+        self.assertEqual([["Eerste | vraag", 2.0, 2, None], ["Tweede", 1.0, 1, 3]], table["rows"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,44 +1,436 @@
+import contextlib
+import csv
+import functools
 import hashlib
+import json
+import logging
+import multiprocessing
 import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import pypandoc
-from flask import Flask, render_template, request, redirect
+from flask import Flask, abort, jsonify, redirect, render_template, request, url_for
 
+import metrics
 import surparser
+from profiling import Profile
 
 UPLOAD_DIR = os.path.join(".", "static")
+CACHE_DIR = os.path.join(".", "cache")
+WORKERS = int(os.getenv("WORKERS", 2))
+WORKER_BACKEND = os.getenv("WORKER_BACKEND", "process")
+STATIC_MAX_AGE = float(os.getenv("STATIC_MAX_AGE", 7 * 24 * 3600))
+STATIC_QUOTA = float(os.getenv("STATIC_QUOTA", 1024 ** 3))
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 64 * 1024 ** 2))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+PANDOC_JOBS = int(os.getenv("PANDOC_JOBS", 1))
+BACKENDS = {"process": ProcessPoolExecutor, "thread": ThreadPoolExecutor}
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_SIZE
+
+
+class JobQueue:
+    """In-process job queue backed by a local pool of worker processes or threads.
+
+    Jobs are identified by a key derived from their input, so submitting the same job
+    twice returns the job that is already queued, running or done. Every worker calls
+    initializer with initargs when it starts, as in concurrent.futures.
+    """
+
+    def __init__(self, workers, backend="process", initializer=None, initargs=()):
+        self.workers = workers
+        self.executor_class = BACKENDS[backend]
+        self.initializer = initializer
+        self.initargs = initargs
+        self.executor = None
+        self.jobs = {}
+        self.directories = {}
+        self.lock = threading.Lock()
+
+    def active_directories(self):
+        """Returns the upload directories of the jobs that are not done yet."""
+
+        with self.lock:
+            return {os.path.normpath(self.directories[job_id])
+                    for job_id, job in self.jobs.items() if not job.done() and self.directories[job_id]}
+
+    def submit(self, job_id, function, *arguments, directory=None, callback=None):
+        """Submits a job unless it is already known; callback is called with the future of a new job when it is done."""
+
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or (job.done() and job.exception() is not None):
+                if self.executor is None:
+                    self.executor = self.executor_class(self.workers, initializer=self.initializer,
+                                                        initargs=self.initargs)
+                self.jobs[job_id] = self.executor.submit(function, *arguments)
+                self.directories[job_id] = directory
+                if callback is not None:
+                    self.jobs[job_id].add_done_callback(callback)
+            return job_id
+
+    def prune(self):
+        """Forgets the jobs that are done and whose upload directory has been removed by evict_static."""
+
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items()
+                           if job.done() and self.directories[job_id] and not os.path.isdir(self.directories[job_id])]:
+                del self.jobs[job_id]
+                del self.directories[job_id]
+
+    def counts(self):
+        """Returns the number of jobs per status: queued, running, done or failed."""
+
+        with self.lock:
+            job_ids = list(self.jobs)
+        return Counter(self.status(job_id) for job_id in job_ids)
+
+    def status(self, job_id):
+        """Returns queued, running, done or failed, or None for an unknown job."""
+
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        elif not job.done():
+            return "running" if job.running() else "queued"
+        else:
+            return "failed" if job.exception() is not None else "done"
+
+    def result(self, job_id):
+        return self.jobs[job_id].result()
+
+    def error(self, job_id):
+        exception = self.jobs[job_id].exception()
+        return f"{type(exception).__name__}: {exception}"
+
+
+pandoc_limiter = multiprocessing.BoundedSemaphore(PANDOC_JOBS)
+
+
+def share_pandoc_limiter(limiter):
+    """Makes a worker use the pandoc limiter of the web process, also when the worker was spawned."""
+
+    global pandoc_limiter
+    pandoc_limiter = limiter
+
+
+queue = JobQueue(WORKERS, WORKER_BACKEND, share_pandoc_limiter, (pandoc_limiter,))
+
+registry = metrics.Registry()
+conversions = registry.counter("surparser_conversions_total", "Conversions requested per output format", ["format"])
+cache_hits = registry.counter("surparser_cache_hits_total", "Conversions served from static/ per output format",
+                              ["format"])
+errors = registry.counter("surparser_errors_total", "Rejected uploads and failed conversions per error type", ["type"])
+upload_bytes = registry.histogram("surparser_upload_bytes", "Size of the uploaded exports",
+                                  buckets=metrics.SIZE_BUCKETS)
+ingest_seconds = registry.histogram("surparser_ingest_seconds", "Time to load an export into the database")
+report_seconds = registry.histogram("surparser_report_seconds", "Time to write the markdown report after loading")
+render_seconds = registry.histogram("surparser_render_seconds",
+                                    "Time to copy the markdown report or convert it with pandoc", ["format"])
+static_bytes = registry.gauge("surparser_static_bytes", "Disk usage of the uploads and results under static/ "
+                                                        "without conversions in progress after the last eviction")
+in_flight = registry.gauge("surparser_conversions_in_flight", "Conversions that are queued or running")
+queued = registry.gauge("surparser_conversions_queued", "Conversions waiting for a worker")
+
+Conversion = namedtuple("Conversion", ["filename", "spans"])
+
+
+@registry.collector
+def count_jobs():
+    counts = queue.counts()
+    in_flight.set(counts["queued"] + counts["running"])
+    queued.set(counts["queued"])
 
 
 @app.route("/")
 def index():
-    _, output_formats = pypandoc.get_pandoc_formats()
-    return render_template("index.html", output_formats=output_formats)
+    return render_template("index.html", output_formats=output_formats())
+
+
+@functools.lru_cache()
+def output_formats():
+    """Lists the output formats of pandoc, which is only asked once."""
+
+    _, formats = pypandoc.get_pandoc_formats()
+    return formats
 
 
 @app.route("/convert", methods=["POST"])
 def convert():
-    with request.files["input"].stream as input_file:
-        csv_data = input_file.read()
-    md5 = hashlib.md5(csv_data).hexdigest()
+    output_format = request.form.get("output-format")
+    if output_format not in output_formats():
+        errors.inc(type="upload_400")
+        abort(400, "Unknown output format")
+    start = time.perf_counter()
+    try:
+        with request.files["input"].stream as input_file:
+            md5 = save_upload(input_file, UPLOAD_DIR, MAX_UPLOAD_SIZE)
+    except UploadError as error:
+        errors.inc(type=f"upload_{error.status}")
+        abort(error.status, str(error))
+    logger.info("upload %s: %.3fs", md5, time.perf_counter() - start)
     directory = os.path.join(UPLOAD_DIR, md5)
-    os.makedirs(directory, exist_ok=True)
-    with open(os.path.join(directory, "ItemsDeliveredRawReport.csv"), "wb") as csv_file:
-        csv_file.write(csv_data)
-    argument_parser = surparser.get_argument_parser()
-    arguments = argument_parser.parse_args(extract_arguments_from_request(directory))
-    surparser.run(arguments)
-    output_filename = os.path.join(directory, "toetsanalyse." + default_extension())
-    pypandoc.convert_file(os.path.join(directory, "toetsanalyse.md"),
-                          request.form["output-format"],
-                          extra_args=["--standalone", "--self-contained"],
-                          outputfile=output_filename)
-    return redirect(output_filename)
+    upload_bytes.observe(os.path.getsize(os.path.join(directory, "ItemsDeliveredRawReport.csv")))
+    conversions.inc(format=output_format)
+    options = normalize_arguments(extract_option_arguments_from_request())
+    output_directory = os.path.join(directory, options_key(options))
+    output_filename = os.path.join(output_directory, output_format, "toetsanalyse." + default_extension())
+    if os.path.exists(output_filename):
+        cache_hits.inc(format=output_format)
+        return redirect(static_url(output_filename), code=303)
+    job_id = job_key(md5, options, output_format)
+    queue.submit(job_id, convert_job, list(extract_arguments_from_request(directory, output_directory)), md5,
+                 output_format, output_filename, directory=directory,
+                 callback=functools.partial(record_conversion, output_format))
+    static_bytes.set(evict_static(UPLOAD_DIR, STATIC_MAX_AGE, STATIC_QUOTA, keep=queue.active_directories()))
+    queue.prune()
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(id=job_id,
+                       status=url_for("job_status", job_id=job_id),
+                       result=url_for("job_result", job_id=job_id)), 202
+    return redirect(url_for("job_result", job_id=job_id), code=303)
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    status = queue.status(job_id)
+    if status is None:
+        abort(404)
+    if status == "failed":
+        return jsonify(id=job_id, status=status, error=queue.error(job_id))
+    return jsonify(id=job_id, status=status)
+
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    status = queue.status(job_id)
+    if status is None:
+        abort(404)
+    elif status == "failed":
+        return queue.error(job_id), 500, {"Content-Type": "text/plain"}
+    elif status == "done":
+        return redirect(static_url(queue.result(job_id).filename))
+    return render_template("job.html", job_id=job_id, status=status), 202
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return registry.expose(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
+def record_conversion(output_format, job):
+    """Records the spans of a finished conversion job, or its error type if it failed."""
+
+    if job.exception() is not None:
+        errors.inc(type=type(job.exception()).__name__)
+        return
+    spans = {span.name: span.seconds for span in job.result().spans if span.parent is None}
+    if "load" in spans:
+        ingest_seconds.observe(spans["load"])
+        report_seconds.observe(sum(seconds for name, seconds in spans.items()
+                                   if name not in ("load", "render", "pandoc")))
+    for name in ("render", "pandoc"):
+        if name in spans:
+            render_seconds.observe(spans[name], format=output_format)
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def check_header(line):
+    """Raises an UploadError unless line is the header row of a Surpass export."""
+
+    try:
+        header = next(csv.reader([line.decode("utf-8-sig")]), [])
+    except UnicodeDecodeError:
+        raise UploadError("The upload is not a UTF-8 encoded CSV file")
+    if "Referentie" not in header or not any(column.startswith("Naam [") for column in header):
+        raise UploadError("The upload is not an ItemsDeliveredRawReport.csv export")
+
+
+def save_upload(stream, upload_dir, max_size, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Copies the upload in chunks to upload_dir/<md5>/ItemsDeliveredRawReport.csv and returns the md5.
+
+    The header row is checked as soon as it has been read, and the upload is rejected
+    as soon as it exceeds max_size bytes.
+    """
+
+    os.makedirs(upload_dir, exist_ok=True)
+    md5 = hashlib.md5()
+    size = 0
+    header = b""
+    checked = False
+    file_descriptor, temporary_filename = tempfile.mkstemp(dir=upload_dir, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as csv_file:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadError(f"The upload is larger than {max_size} bytes", 413)
+                if not checked:
+                    header += chunk
+                    if b"\n" in header:
+                        check_header(header.split(b"\n", 1)[0])
+                        checked = True
+                md5.update(chunk)
+                csv_file.write(chunk)
+        if not checked:
+            check_header(header)
+        directory = os.path.join(upload_dir, md5.hexdigest())
+        os.makedirs(directory, exist_ok=True)
+        csv_filename = os.path.join(directory, "ItemsDeliveredRawReport.csv")
+        if os.path.exists(csv_filename):
+            os.remove(temporary_filename)
+        else:
+            os.replace(temporary_filename, csv_filename)
+        os.utime(directory)
+    except BaseException:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
+    return md5.hexdigest()
+
+
+def static_url(filename):
+    return url_for("static", filename=os.path.relpath(filename, UPLOAD_DIR).replace(os.sep, "/"))
+
+
+@contextlib.contextmanager
+def replacing(filename):
+    """Yields the name of a new temporary file next to filename, which replaces filename when the block succeeds.
+
+    mkstemp gives every worker thread and process a file of its own, also when several jobs write the same file.
+    """
+
+    file_descriptor, temporary_filename = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+    os.close(file_descriptor)
+    try:
+        yield temporary_filename
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
+
+
+def write_report(argv, md5, output_filename, profile, output_format="markdown"):
+    """Runs surparser with the options in argv and writes the report in output_format to output_filename."""
+
+    with replacing(output_filename) as temporary_filename:
+        arguments = surparser.get_argument_parser().parse_args(
+            argv + ["--output", temporary_filename, "--format", output_format])
+        arguments.input_md5 = md5
+        surparser.run(arguments, profile)
+
+
+def convert_job(argv, md5, output_format, output_filename):
+    """Converts a single upload in a worker process and returns the output filename and the timed spans.
+
+    html5 is written directly by the HTML writer of surparser. For the other formats the
+    markdown of an earlier job with the same options is reused, so switching only the
+    output format just reruns pandoc.
+    """
+
+    output_directory = os.path.dirname(os.path.dirname(output_filename))
+    markdown_filename = os.path.join(output_directory, "toetsanalyse.md")
+    os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+    profile = Profile()
+    if output_format == "html5":
+        write_report(argv, md5, output_filename, profile, "html")
+    else:
+        if not os.path.exists(markdown_filename):
+            write_report(argv, md5, markdown_filename, profile)
+        with replacing(output_filename) as temporary_filename:
+            if output_format == "markdown":
+                with profile.span("render"):
+                    shutil.copyfile(markdown_filename, temporary_filename)
+            else:
+                with pandoc_limiter, profile.span("pandoc"):
+                    pypandoc.convert_file(markdown_filename,
+                                          output_format,
+                                          extra_args=["--standalone", "--self-contained"],
+                                          outputfile=temporary_filename)
+    logger.info("convert %s %s: %s", md5, output_format, profile.summary_line())
+    return Conversion(output_filename, profile.spans)
+
+
+def normalize_arguments(arguments):
+    """Returns the arguments as a sorted list of [option, value] pairs; flags get the value None."""
+
+    pairs = []
+    for argument in arguments:
+        if argument.startswith("--"):
+            pairs.append([argument, None])
+        else:
+            pairs[-1][1] = argument
+    return sorted(pairs, key=lambda pair: (pair[0], pair[1] or ""))
+
+
+def options_key(options):
+    """Identifies the markdown generated for the normalized surparser options."""
+
+    return hashlib.sha1(json.dumps(options).encode()).hexdigest()
+
+
+def job_key(md5, options, output_format):
+    """Identifies a conversion by the upload, the normalized surparser options and the output format."""
+
+    key = json.dumps([md5, options, output_format])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def directory_size(directory):
+    """Returns the total size of the files under directory, skipping files that disappear while it is walked."""
+
+    size = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(root, filename))
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def evict_static(upload_dir, max_age, quota, keep=()):
+    """Removes upload directories unused for max_age seconds, then the least recently used ones above quota bytes.
+
+    The directories in keep, which have conversions in progress, are neither sized nor removed.
+    Returns the size in bytes of the remaining directories that are not in keep.
+    """
+
+    if not os.path.isdir(upload_dir):
+        return 0
+    entries = []
+    for name in os.listdir(upload_dir):
+        directory = os.path.join(upload_dir, name)
+        if os.path.normpath(directory) in keep or not os.path.isdir(directory):
+            continue
+        try:
+            entries.append((os.path.getmtime(directory), directory_size(directory), directory))
+        except FileNotFoundError:
+            continue  # removed by a concurrent eviction
+    total_size = sum(size for _, size, _ in entries)
+    now = time.time()
+    for mtime, size, directory in sorted(entries):
+        if now - mtime > max_age or total_size > quota:
+            shutil.rmtree(directory, ignore_errors=True)
+            total_size -= size
+    return total_size
 
 
 def extract_checkbox_arguments_from_request():
-    checkboxes = ["answer-score", "distribution", "item-type", "learning-goals", "plot", "student-detail",
-                  "student-score", "test-title", "translation", "units"]
+    checkboxes = ["answer-score", "distribution", "item-analysis", "item-type", "learning-goals", "plot", "student-detail",
+                  "student-score", "test-title", "timing", "translation", "units"]
     for checkbox in checkboxes:
         if checkbox in request.form:
             yield f"--{checkbox}"
@@ -64,15 +456,9 @@ def default_extension():
         return default_extensions.get(request.form["output-format"], request.form["output-format"])
 
 
-def extract_arguments_from_request(directory):
+def extract_option_arguments_from_request():
     yield from extract_checkbox_arguments_from_request()
 
-    yield "--input"
-    yield os.path.join(directory, "ItemsDeliveredRawReport.csv")
-
-    yield "--output"
-    yield os.path.join(directory, "toetsanalyse.md")
-
     if "cesuur" in request.form:
         try:
             cesuur = float(request.form["cesuur"])
@@ -81,16 +467,28 @@ def extract_arguments_from_request(directory):
         except ValueError:
             pass
 
-    if "plot" in request.form:
-        yield "--plot-dir"
-        yield directory
-
     if "output-format" in request.form and request.form["output-format"] == "pdf":
         yield "--plot-extension"
         yield "pdf"
 
 
+def extract_arguments_from_request(directory, output_directory):
+    yield from extract_option_arguments_from_request()
+
+    yield "--input"
+    yield os.path.join(directory, "ItemsDeliveredRawReport.csv")
+
+    yield "--cache-dir"
+    yield CACHE_DIR
+
+    if "plot" in request.form:
+        yield "--plot-dir"
+        yield output_directory
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     pypandoc.ensure_pandoc_installed()
+    output_formats()
 
     app.run(host='0.0.0.0', port=os.getenv('PORT', 8080), debug=True)
@@ -0,0 +1,210 @@
+"""Writers for the report produced by surparser.
+
+The output_* functions of surparser describe every section as a Section of
+headings, tables and images. A writer turns these sections into markdown,
+HTML, CSV or JSON, so only formats that none of the writers supports have to
+go through pandoc.
+"""
+
+import base64
+import csv
+import html
+import json
+import mimetypes
+import os
+from collections import namedtuple
+
+Section = namedtuple("Section", ["title", "blocks"])
+Heading = namedtuple("Heading", ["text"])
+Image = namedtuple("Image", ["title", "filename"])
+Table = namedtuple("Table", ["columns", "rows"])
+Column = namedtuple("Column", ["name", "align", "width", "format"])
+Column.__new__.__defaults__ = ("left", None, "")
+Strong = namedtuple("Strong", ["value"])
+
+
+def format_cell(value, column):
+    """Formats a cell with the format of its column; None is an empty cell."""
+
+    if value is None:
+        return ""
+    elif isinstance(value, Strong):
+        return format_cell(value.value, column)
+    return format(value, column.format)
+
+
+def plain(value):
+    """Returns the value of a cell without emphasis, as a Python number or string."""
+
+    if isinstance(value, Strong):
+        value = value.value
+    return value.item() if hasattr(value, "item") else value
+
+
+def data_uri(filename):
+    """Returns the file as a data URI, or None when its type is unknown."""
+
+    mime_type = mimetypes.guess_type(filename)[0]
+    if mime_type is None or not os.path.exists(filename):
+        return None
+    with open(filename, "rb") as data_file:
+        return "data:{};base64,{}".format(mime_type, base64.b64encode(data_file.read()).decode())
+
+
+class MarkdownWriter:
+    """Writes pandoc flavoured markdown, one write per section."""
+
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, section):
+        lines = [section.title, "=" * len(section.title), ""]
+        for block, following in zip(section.blocks, list(section.blocks[1:]) + [None]):
+            if isinstance(block, Heading):
+                lines += [block.text, "-" * len(block.text)]
+            elif isinstance(block, Image):
+                lines.append(f"![{block.title}]({block.filename})")
+            elif any(column.name for column in block.columns):
+                lines += self.pipe_table(block)
+            else:
+                lines += self.simple_table(block)
+            # The report has never had an empty line between a table and the heading after it
+            if not (isinstance(block, Table) and isinstance(following, Heading)):
+                lines.append("")
+        self.output.write("\n".join(lines) + "\n")
+
+    @staticmethod
+    def cell(value, column):
+        text = format_cell(value, column)
+        if isinstance(value, str):
+            text = text.replace("|", "/")
+        return f"**{text}**" if isinstance(value, Strong) else text
+
+    def pipe_table(self, table):
+        header = " | ".join(column.name.ljust(column.width or 0) for column in table.columns)
+        separator = ""
+        for column in table.columns:
+            width = column.width or len(column.name)
+            if column.align == "right":
+                separator += "-" * width + ":| "
+            else:
+                separator += ("-" * width).ljust(len(column.name)) + " | "
+        lines = [header.rstrip(), separator[:-2].rstrip()]
+        for row in table.rows:
+            lines.append(" | ".join(self.cell(value, column) for value, column in zip(row, table.columns)))
+        return lines
+
+    def simple_table(self, table):
+        rule = "   ".join("-" * column.width for column in table.columns)
+        lines = [rule]
+        for row in table.rows:
+            cells = [self.cell(value, column) for value, column in zip(row, table.columns)]
+            lines.append("".join(cell.ljust(column.width + 3)
+                                 for cell, column in zip(cells[:-1], table.columns)) + cells[-1])
+        return lines + [rule]
+
+    def close(self):
+        self.output.close()
+
+
+class HtmlWriter:
+    """Writes a self-contained HTML document with the plots embedded as data URIs."""
+
+    def __init__(self, output):
+        self.output = output
+        self.parts = []
+
+    def write(self, section):
+        parts = [f"<h1>{html.escape(section.title)}</h1>"]
+        for block in section.blocks:
+            if isinstance(block, Heading):
+                parts.append(f"<h2>{html.escape(block.text)}</h2>")
+            elif isinstance(block, Image):
+                source = data_uri(block.filename) or block.filename
+                parts.append(f'<p><img alt="{html.escape(block.title)}" src="{html.escape(source)}"></p>')
+            else:
+                parts.append(self.table(block))
+        self.parts.append("\n".join(parts))
+
+    @staticmethod
+    def cell(tag, text, column):
+        style = ' style="text-align: right;"' if column.align == "right" else ""
+        return f"<{tag}{style}>{text}</{tag}>"
+
+    def table(self, table):
+        rows = []
+        if any(column.name for column in table.columns):
+            rows.append("<thead><tr>{}</tr></thead>".format(
+                "".join(self.cell("th", html.escape(column.name.strip()), column) for column in table.columns)))
+        for row in table.rows:
+            cells = []
+            for value, column in zip(row, table.columns):
+                text = html.escape(format_cell(value, column))
+                cells.append(self.cell("td", f"<strong>{text}</strong>" if isinstance(value, Strong) else text,
+                                       column))
+            rows.append("<tr>{}</tr>".format("".join(cells)))
+        return "<table>\n{}\n</table>".format("\n".join(rows))
+
+    def close(self):
+        self.output.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>Toetsanalyse</title>\n"
+                          "<style>\ntable {{ border-collapse: collapse; }}\ntd, th {{ padding: 0 0.5em; }}\n</style>\n"
+                          "</head>\n<body>\n{}\n</body>\n</html>\n".format("\n".join(self.parts)))
+        self.output.close()
+
+
+class CsvWriter:
+    """Writes every table as a block of CSV rows: the section and heading, the column names and the rows.
+
+    Blocks are separated by an empty row and cells are written unformatted.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.writer = csv.writer(output, lineterminator="\n")
+
+    def write(self, section):
+        heading = None
+        rows = []
+        for block in section.blocks:
+            if isinstance(block, Heading):
+                heading = block.text
+            elif isinstance(block, Table):
+                rows.append([title for title in [section.title, heading] if title])
+                if any(column.name for column in block.columns):
+                    rows.append([column.name.strip() for column in block.columns])
+                rows += [[plain(value) for value in row] for row in block.rows]
+                rows.append([])
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.output.close()
+
+
+class JsonWriter:
+    """Writes a single JSON document with a list of sections, each with a list of headings, tables and images."""
+
+    def __init__(self, output):
+        self.output = output
+        self.sections = []
+
+    def write(self, section):
+        blocks = []
+        for block in section.blocks:
+            if isinstance(block, Heading):
+                blocks.append({"heading": block.text})
+            elif isinstance(block, Image):
+                blocks.append({"image": block.filename, "title": block.title})
+            else:
+                blocks.append({
+                    "columns": [column.name.strip() for column in block.columns],
+                    "rows": [[plain(value) for value in row] for row in block.rows]
+                })
+        self.sections.append({"title": section.title, "blocks": blocks})
+
+    def close(self):
+        json.dump({"sections": self.sections}, self.output, indent=2)
+        self.output.write("\n")
+        self.output.close()
+
+
+WRITERS = {"csv": CsvWriter, "html": HtmlWriter, "json": JsonWriter, "markdown": MarkdownWriter}